@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from app_run.caching import bump_version
+from app_run.ingest import forget_session
+from app_run.models import Run, Position, RunFinalizeJob
+from app_run.tracks import ROW_COLUMNS, save_run_track, track_rows
+
+# Архив точек давно законченных забегов: у забега остаётся только сжатый трек без потерь RunTrack
+# (формат в app_run.tracks), а строки Position удаляются из горячей таблицы, в ней остаются только
+# свежие и идущие забеги. Удаляет команда python manage.py archive_positions --days N
+# (постобработка - только при ARCHIVE_ON_FINALIZE = True); RunTrack.archived_at отмечает,
+# что строк забега в Position больше нет.
+# Список точек забега (?run=), экспорт, трек и пересчёт итогов читают такие забеги из трека.
+# Список точек без ?run= отдаёт только строки Position, точек архивных забегов в нём нет.
+
+
+def archive_candidates(days):
+    # законченные и обработанные забеги, последняя точка которых старше days дней, с точками в Position
+    border = timezone.now() - timedelta(days=days)
+    return Run.objects.annotate(finished_at=Coalesce('last_position_at', 'created_at')).filter(
+        Exists(Position.objects.filter(run=OuterRef('pk'))),
+        status=Run.FINISHED, finalize_status=RunFinalizeJob.DONE, finished_at__lt=border,
+    ).order_by('id')
+
+
+def archive_run(run_id):
+    # удаляет строки Position забега одной транзакцией; возвращает число удалённых точек.
+    # Трек перед этим перекодируется по строкам: он мог быть в старом формате v1 с потерями,
+    # а точки - измениться после постобработки
+    with transaction.atomic():
+        Run.objects.select_for_update().filter(pk=run_id).first()  # не вместе с параллельной архивацией
+        positions = Position.objects.filter(run_id=run_id)
+        count = positions.count()
+        if not count:
+            return 0
+        save_run_track(run_id, archived=True)
+        # у Position нет приёмников post_delete (app_run.signals): один DELETE, версия и состояние приёма -
+        # один раз на забег
+        positions.delete()
+        bump_version(Position)
+        transaction.on_commit(lambda: forget_session(run_id))
+    return count
+
+
+def archived_rows(run_id):
+    # точки архивного забега кортежами ROW_COLUMNS; [] - забег не в архиве
+    return track_rows(run_id)
+
+
+def archived_positions(run_id):
+    # те же точки несохраняемыми Position - для сериализаторов API
+    return [Position(run_id=run_id, **dict(zip(ROW_COLUMNS, row))) for row in archived_rows(run_id)]
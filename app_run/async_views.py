@@ -0,0 +1,116 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, Http404
+from django.views.decorators.http import require_POST
+
+from app_run.buffer import accept_positions, flush_local, PendingPoints
+from app_run.caching import abump_version
+from app_run.finalize import enqueue_finalize, finalize_run
+from app_run.ingest import aget_session, aforget_session, aremember_positions, session_run, last_position
+from app_run.live import broadcaster, position_events
+from app_run.models import Run, Position, RunFinalizeJob
+from app_run.serializers import PositionSerializer, PositionBatchItemSerializer, RunSerializer
+from app_run.totals import run_totals_updates
+from app_run.views import search_collectible
+
+# Асинхронный приём точек и start/stop забега для запуска под ASGI (project_run.asgi).
+# Пока запрос ждёт базу, воркер обслуживает другие запросы; расчёт расстояний (numpy)
+# уходит в отдельный пул потоков, чтобы не занимать event loop.
+# Ответы те же, что у /api/positions/ и /api/runs/<id>/<condition>/, но только JSON и по одной точке.
+# Сравнение с WSGI: python manage.py benchmark_ingest
+
+_distance_pool = None
+
+
+def distance_pool():
+    global _distance_pool
+    if _distance_pool is None:
+        _distance_pool = ThreadPoolExecutor(settings.ASYNC_DISTANCE_THREADS, thread_name_prefix='distance')
+    return _distance_pool
+
+
+async def track_steps_in_pool(prev, positions):
+    from app_run.distance import track_steps
+
+    return await asyncio.get_running_loop().run_in_executor(distance_pool(), track_steps, prev, positions)
+
+
+@require_POST
+async def position_create(request):
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'Тело запроса - JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'detail': 'Одна точка; пакет точек - POST /api/positions/'}, status=400)
+
+    serializer = PositionBatchItemSerializer(data=data)  # проверка координат и времени, без базы
+    errors = {} if serializer.is_valid() else dict(serializer.errors)
+    run_id = str(data.get('run', ''))
+    state = await aget_session(int(run_id)) if run_id.isdigit() else None
+    if state is None:
+        errors['run'] = ['Забег не найден']
+    elif state['status'] != Run.IN_PROGRESS:
+        errors['run'] = ["Статус забега должен быть 'in progress'"]
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    run = session_run(int(run_id), state)
+    position = Position(run=run, **serializer.validated_data)
+    distance_km = await track_steps_in_pool(last_position(run.id, state), [position])
+    if settings.POSITION_WRITE_BEHIND:
+        # запись в журнал без ожидания базы, в базу точку пишет поток app_run.buffer
+        accept_positions(run, [position], distance_km)
+        await aremember_positions(run.id, [position])
+        return JsonResponse(PositionSerializer(position).data, status=202)
+    await position.asave()
+    await Run.objects.filter(pk=run.id).aupdate(**run_totals_updates([position], distance_km))
+    await abump_version(Run)
+    await aremember_positions(run.id, [position])
+    broadcaster.publish(position_events(run.athlete_id, [position]))
+    await sync_to_async(search_collectible)(run, [(position.latitude, position.longitude)])
+    return JsonResponse(PositionSerializer(position).data, status=201)
+
+
+def _stop_run(run_id):
+    # в async ORM нет транзакций: смена статуса и задача постобработки пишутся вместе в потоке
+    with transaction.atomic():
+        stopped = Run.objects.filter(pk=run_id, status=Run.IN_PROGRESS).update(
+            status=Run.FINISHED, finalize_status=RunFinalizeJob.PENDING
+        )
+        if stopped and settings.RUN_FINALIZE_ASYNC:
+            enqueue_finalize(Run(pk=int(run_id)))
+    return stopped
+
+
+@require_POST
+async def run_transition(request, run_id, condition):
+    # start: init -> in_progress, stop: in_progress -> finished; статус меняется условным UPDATE,
+    # поэтому два одновременных stop не поставят две задачи постобработки
+    if condition not in ('start', 'stop') or not run_id.isdigit():
+        raise Http404
+    if not await Run.objects.filter(pk=run_id).aexists():
+        raise Http404
+    if condition == 'start':
+        changed = await Run.objects.filter(pk=run_id, status=Run.INIT).aupdate(status=Run.IN_PROGRESS)
+    else:
+        await sync_to_async(flush_local)()
+        changed = await sync_to_async(_stop_run)(run_id)
+    if not changed:
+        return HttpResponse(status=400)
+
+    # update() не шлёт сигналы: версию ответов и состояние приёма точек сбрасываем сами
+    await abump_version(Run)
+    await aforget_session(run_id)
+    if condition == 'stop' and not settings.RUN_FINALIZE_ASYNC:
+        try:
+            await sync_to_async(finalize_run)(int(run_id))
+        except PendingPoints:
+            await sync_to_async(enqueue_finalize)(Run(pk=int(run_id)))
+    run = await Run.objects.select_related('athlete').aget(pk=run_id)
+    return JsonResponse(RunSerializer(run).data)
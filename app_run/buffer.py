@@ -0,0 +1,289 @@
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from app_run.caching import bump_version
+from app_run.live import publish_positions
+from app_run.models import Run, Position
+from app_run.totals import run_totals_updates
+
+# Отложенная запись точек (write-behind), включается POSITION_WRITE_BEHIND.
+# Принятая точка дописывается строкой JSON в журнал процесса в POSITION_BUFFER_DIR и в очередь
+# в памяти; фоновый поток раз в POSITION_FLUSH_INTERVAL_MS или по набору POSITION_FLUSH_ROWS точек
+# записывает очередь одним bulk_create и одним UPDATE итогов на забег.
+#
+# Журнал: активный сегмент <pid>-<ns>.log держится под flock процесса. Перед записью в базу
+# сегмент переименовывается в .sealed и удаляется после коммита. Сегменты без живого владельца
+# (процесс упал) дочитываются в базу при старте и периодически любым процессом; точки, которые
+# уже есть в базе (упали между коммитом и удалением сегмента), пропускаются.
+# Чтение: buffered_points() отдаёт ещё не записанные точки забега из журналов всех процессов машины.
+
+logger = logging.getLogger('app_run.buffer')
+
+REPLAY_EVERY_TICKS = 100  # как часто поток ищет брошенные сегменты других процессов
+
+
+class PendingPoints(Exception):
+    # у забега есть точки, ещё не записанные в базу
+    pass
+
+
+def _encode(point):
+    return json.dumps({**point, 'date_time': point['date_time'].isoformat() if point['date_time'] else None})
+
+
+def _decode(line):
+    point = json.loads(line)
+    point['date_time'] = datetime.fromisoformat(point['date_time']) if point['date_time'] else None
+    return point
+
+
+def buffered_point(position, athlete_id, step_km):
+    # точка для журнала: поля Position, атлет для ленты и предметов, длина шага для итогов забега
+    return {
+        'run_id': position.run_id,
+        'athlete_id': athlete_id,
+        'latitude': position.latitude,
+        'longitude': position.longitude,
+        'date_time': position.date_time,
+        'speed': position.speed,
+        'distance': position.distance,
+        'step_km': step_km,
+    }
+
+
+def accept_positions(run, positions, distance_km):
+    # вместо INSERT: точки в журнал процесса; пройденное пачкой расстояние - на её последней точке
+    steps = [0.0] * (len(positions) - 1) + [distance_km]
+    get_buffer().append([buffered_point(p, run.athlete_id, step) for p, step in zip(positions, steps)])
+
+
+def _read_segment(path):
+    points = []
+    try:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    points.append(_decode(line))
+                except ValueError:
+                    pass  # строка, которую владелец ещё дописывает
+    except FileNotFoundError:
+        pass
+    return points
+
+
+def _segments(directory):
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.endswith('.log') or name.endswith('.sealed')
+    )
+
+
+def buffered_points(run_id):
+    # ещё не записанные в базу точки забега из журналов всех процессов, в порядке приёма
+    directory = settings.POSITION_BUFFER_DIR
+    if not settings.POSITION_WRITE_BEHIND or not os.path.isdir(directory):
+        return []
+    return [point for path in _segments(directory) for point in _read_segment(path) if point['run_id'] == run_id]
+
+
+def buffered_positions(run_id):
+    # те же точки несохранёнными Position (id=None) - для ответов API
+    return [Position(run_id=p['run_id'], latitude=p['latitude'], longitude=p['longitude'], date_time=p['date_time'],
+                     speed=p['speed'], distance=p['distance'])
+            for p in buffered_points(run_id)]
+
+
+def write_points(points, skip_existing=False):
+    # точки одной транзакцией: bulk_create, UPDATE итогов по забегу, затем лента и поиск предметов
+    from app_run.views import search_collectible
+
+    by_run = {}
+    for point in points:
+        by_run.setdefault(point['run_id'], []).append(point)
+    existing_runs = set(Run.objects.filter(pk__in=by_run).values_list('id', flat=True))
+    positions_by_run = {}
+    for run_id, run_points in by_run.items():
+        if run_id not in existing_runs:
+            continue  # забег удалён, пока точки ждали записи
+        if skip_existing:
+            stored = set(Position.objects.filter(
+                run_id=run_id, date_time__in=[p['date_time'] for p in run_points if p['date_time']]
+            ).values_list('date_time', 'latitude', 'longitude'))
+            run_points = [p for p in run_points if (p['date_time'], p['latitude'], p['longitude']) not in stored]
+        if run_points:
+            positions_by_run[run_id] = run_points
+
+    if not positions_by_run:
+        return 0
+    with transaction.atomic():
+        created = {
+            run_id: Position.objects.bulk_create([
+                Position(run_id=run_id, latitude=p['latitude'], longitude=p['longitude'], date_time=p['date_time'],
+                         speed=p['speed'], distance=p['distance'])
+                for p in run_points
+            ])
+            for run_id, run_points in positions_by_run.items()
+        }
+        for run_id, positions in created.items():
+            distance_km = sum(point['step_km'] for point in positions_by_run[run_id])
+            Run.objects.filter(pk=run_id).update(**run_totals_updates(positions, distance_km))
+        bump_version(Run, Position)
+        for run_id, positions in created.items():
+            athlete_id = positions_by_run[run_id][0]['athlete_id']
+            publish_positions(athlete_id, positions)
+            search_collectible(Run(id=run_id, athlete_id=athlete_id), [(p.latitude, p.longitude) for p in positions])
+    return sum(len(positions) for positions in created.values())
+
+
+class PositionBuffer:
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = os.getpid()
+        self.lock = threading.Lock()  # очередь и активный сегмент
+        self.flush_lock = threading.Lock()  # одна запись в базу за раз
+        self.pending = []
+        self.unwritten = []  # сегменты к записи в базу: (точки, путь, файл под flock, брошенный ли)
+        self.wakeup = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._open_segment()
+        self.thread = threading.Thread(target=self._run, name='position-flusher', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _open_segment(self):
+        self.path = os.path.join(self.directory, f'{self.pid}-{time.time_ns()}.log')
+        self.file = open(self.path, 'a', encoding='utf-8')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, points):
+        lines = ''.join(_encode(point) + '\n' for point in points)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+            if settings.POSITION_BUFFER_FSYNC:
+                os.fsync(self.file.fileno())
+            self.pending.extend(points)
+            full = len(self.pending) >= settings.POSITION_FLUSH_ROWS
+        if full:
+            self.wakeup.set()
+
+    def _seal(self):
+        # активный сегмент становится .sealed (файл и flock остаются у нас), пишем в новый
+        with self.lock:
+            if not self.pending:
+                return None
+            points, self.pending = self.pending, []
+            sealed_path = self.path[:-len('.log')] + '.sealed'
+            os.rename(self.path, sealed_path)
+            sealed = (points, sealed_path, self.file, False)
+            self._open_segment()
+        return sealed
+
+    def flush(self):
+        # записывает в базу всё принятое к этому моменту; возвращает число записанных точек
+        written = 0
+        with self.flush_lock:
+            sealed = self._seal()
+            if sealed is not None:
+                self.unwritten.append(sealed)
+            while self.unwritten:
+                points, path, file, replayed = self.unwritten[0]
+                # брошенный сегмент мог упасть между коммитом и удалением - его точки сверяем с базой
+                written += write_points(points, skip_existing=replayed)
+                self.unwritten.pop(0)
+                os.unlink(path)
+                file.close()
+        return written
+
+    def replay_orphans(self):
+        # сегменты процессов, которые больше не держат flock; flock берём себе до записи сегмента
+        with self.flush_lock:
+            own = {self.path, *(path for _, path, _, _ in self.unwritten)}
+            for path in _segments(self.directory):
+                if path in own:
+                    continue
+                try:
+                    file = open(path, encoding='utf-8')
+                except FileNotFoundError:
+                    continue
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    file.close()
+                    continue
+                if not os.path.exists(path):  # владелец успел записать и удалить сегмент
+                    file.close()
+                    continue
+                self.unwritten.append((_read_segment(path), path, file, True))
+
+    def _run(self):
+        ticks = 0
+        while True:
+            self.wakeup.wait(settings.POSITION_FLUSH_INTERVAL_MS / 1000)
+            self.wakeup.clear()
+            try:
+                if ticks % REPLAY_EVERY_TICKS == 0:
+                    self.replay_orphans()
+                self.flush()
+            except Exception:
+                # сегменты остаются в unwritten под flock процесса, повтор на следующем такте
+                logger.exception('Не удалось записать буфер точек')
+                connection.close()
+            ticks += 1
+
+    def close(self):
+        # при выходе процесса: всё в базу, пустой активный сегмент удаляется
+        self.flush()
+        with self.lock:
+            os.unlink(self.path)
+            self.file.close()
+
+    def close_inherited(self):
+        # в дочернем процессе после fork: копии файлов родителя закрываются, flock остаётся у родителя
+        self.file.close()
+        for _, _, file, _ in self.unwritten:
+            file.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    # буфер текущего процесса; после fork создаётся заново со своим сегментом и потоком
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.pid != os.getpid():
+            _buffer = PositionBuffer(settings.POSITION_BUFFER_DIR)
+        return _buffer
+
+
+def _after_fork():
+    global _buffer
+    if _buffer is not None:
+        _buffer.close_inherited()
+        _buffer = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def flush_local():
+    # перед stop: записать в базу точки, принятые этим процессом
+    if settings.POSITION_WRITE_BEHIND and _buffer is not None and _buffer.pid == os.getpid():
+        _buffer.flush()
+
+
+def check_flushed(run_id):
+    # постобработка забега ждёт, пока все его точки окажутся в базе
+    if buffered_points(run_id):
+        raise PendingPoints(f'У забега {run_id} есть незаписанные точки')
@@ -0,0 +1,81 @@
+import hashlib
+import secrets
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+# Кэш ответов read-heavy эндпоинтов. Ключ - путь + query-параметры + версии моделей,
+# от которых зависит ответ. Версию модели меняют сигналы post_save/post_delete/m2m_changed
+# (app_run.signals), а места с bulk_create/update(), где сигналов нет, вызывают bump_version сами.
+# Версия меняется после коммита: иначе параллельный GET прочтёт новую версию вместе со старыми
+# строками и закэширует их под ней. Старые записи на старых версиях никто больше не читает,
+# а RESPONSE_CACHE_TIMEOUT ограничивает срок жизни любой записи, если версия всё же не сменилась.
+# Версии общие только в общем кэше: в production это DatabaseCache (project_run.settings.production).
+
+VERSION_KEY = 'model-version:{}'
+# версия без модели: меняется только при сохранении/удалении CollectibleItem, а не при сборе предметов,
+# на ней держится кэш предметов по ячейкам (app_run.ingest.cell_items)
+COLLECTIBLE_CELLS = 'collectible-cells'
+# версия упрощённых треков одного забега в кэше (RunViewSet.track): меняется при правке забега и его точек
+RUN_TRACK = 'run-track:{}'
+
+
+def _version_key(model):
+    # модель или имя версии строкой
+    return VERSION_KEY.format(model if isinstance(model, str) else model._meta.label_lower)
+
+
+def _new_version():
+    # новое случайное значение вместо incr: incr у файлового кэша и DatabaseCache - это get + set,
+    # и параллельные инкременты теряются, а из двух одновременных set любой даёт версию, отличную от старой
+    return f'{time.time_ns()}-{secrets.token_hex(4)}'
+
+
+def _set_versions(models):
+    cache.set_many({_version_key(model): _new_version() for model in models}, None)
+
+
+def bump_version(*models):
+    # после коммита текущей транзакции, вне транзакции - сразу; при откате версия не меняется
+    transaction.on_commit(lambda: _set_versions(models))
+
+
+async def abump_version(*models):
+    # для асинхронных view: они пишут без транзакции (autocommit), версия меняется сразу
+    await cache.aset_many({_version_key(model): _new_version() for model in models}, None)
+
+
+def model_versions(models):
+    # если версии нет (кэш очищен), заводим новую - она не совпадёт с версиями уже лежащих в кэше ответов
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def cache_response(*models, timeout=None):
+    # декоратор метода view (self, request, ...) или функции (request, ...), кэширует успешный ответ
+    # на timeout секунд, по умолчанию RESPONSE_CACHE_TIMEOUT
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if hasattr(arg, 'query_params'))
+            params = sorted(request.query_params.lists())
+            raw_key = f'{request.path}?{params}:{model_versions(models)}'
+            key = 'response:' + hashlib.md5(raw_key.encode()).hexdigest()
+            cached = cache.get(key)
+            if cached is not None:
+                return Response(cached)
+            response = view(*args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout if timeout is not None else settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,30 @@
+from app_run.caching import bump_version
+from app_run.models import Challenge
+
+# Реестр челленджей: каждый задаётся порогом по полю AthleteStats.
+# Все правила проверяются по одному снимку итогов атлета при постобработке забега,
+# награды вставляются одним запросом, повтор отсекает уникальность (athlete, full_name).
+# Новый челлендж - новая строка в RULES, запросов к базе от этого не прибавляется.
+
+
+class Rule:
+    def __init__(self, full_name, field, threshold):
+        self.full_name = full_name
+        self.field = field  # runs_finished, total_distance (км) или total_time_seconds
+        self.threshold = threshold
+
+    def passed(self, stats):
+        return getattr(stats, self.field) >= self.threshold
+
+
+RULES = [
+    Rule('Сделай 10 Забегов!', 'runs_finished', 10),
+    Rule('Пробеги 50 километров!', 'total_distance', 50),
+]
+
+
+def award_challenges(stats):
+    earned = [Challenge(full_name=rule.full_name, athlete_id=stats.user_id) for rule in RULES if rule.passed(stats)]
+    if earned:
+        Challenge.objects.bulk_create(earned, ignore_conflicts=True)
+        bump_version(Challenge)
@@ -0,0 +1,87 @@
+import numpy as np
+from django.conf import settings
+
+# Векторный расчёт расстояний по массивам широт/долгот вместо попарных вызовов geopy.geodesic.
+# Формула выбирается настройкой DISTANCE_FORMULA:
+#   'haversine' - сфера со средним радиусом Земли, самая быстрая, ошибка до ~0.5%
+#   'lambert'   - формула Ламберта для эллипсоида WGS-84, ошибка порядка метров на тысячах км
+# Сравнение скорости и точности с geodesic: python manage.py distance_benchmark
+
+EARTH_RADIUS_M = 6371008.8
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+def _central_angle(phi1, lam1, phi2, lam2):
+    # центральный угол между точками по формуле гаверсинусов (радианы)
+    h = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    phi1, lam1, phi2, lam2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    return EARTH_RADIUS_M * _central_angle(phi1, lam1, phi2, lam2)
+
+
+def lambert_m(lat1, lon1, lat2, lon2):
+    # центральный угол считается по приведённым широтам, затем поправка на сжатие эллипсоида
+    lam1, lam2 = np.radians(lon1), np.radians(lon2)
+    beta1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    beta2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sigma = _central_angle(beta1, lam1, beta2, lam2)
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_half = np.sin(sigma / 2)
+    cos_half = np.cos(sigma / 2)
+    # у совпадающих точек sigma = 0, у антиподов cos(sigma/2) = 0 - знаменатели подменяем, поправка там 0
+    safe_sin = np.where(sin_half == 0, 1.0, sin_half)
+    safe_cos = np.where(cos_half == 0, 1.0, cos_half)
+    x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / safe_cos ** 2
+    y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / safe_sin ** 2
+    return WGS84_A * (sigma - WGS84_F / 2 * (x + y))
+
+
+FORMULAS = {
+    'haversine': haversine_m,
+    'lambert': lambert_m,
+}
+
+
+def distances_m(lat1, lon1, lat2, lon2):
+    # попарные расстояния в метрах, аргументы - числа или массивы (работает broadcasting numpy)
+    formula = FORMULAS[getattr(settings, 'DISTANCE_FORMULA', 'lambert')]
+    return formula(*(np.asarray(value, dtype=float) for value in (lat1, lon1, lat2, lon2)))
+
+
+def path_distances_m(latitudes, longitudes):
+    # длины отрезков ломаной: массив из len(points) - 1 расстояний в метрах
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    if latitudes.size < 2:
+        return np.zeros(0)
+    return distances_m(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+
+def track_steps(prev, positions):
+    # заполняет у новых точек забега speed (м/с) и накопленную distance (км) одним векторным проходом,
+    # prev - последняя уже записанная точка или None; возвращает пройденное новыми точками расстояние в км
+    if not positions:
+        return 0.0
+    chain = ([prev] if prev is not None else []) + list(positions)
+    steps_m = path_distances_m([p.latitude for p in chain], [p.longitude for p in chain])
+    times = np.array([p.date_time.timestamp() if p.date_time else np.nan for p in chain])
+    deltas = np.diff(times)
+    if prev is None:
+        steps_m = np.concatenate(([0.0], steps_m))
+        deltas = np.concatenate(([np.nan], deltas))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.where(deltas > 0, steps_m / deltas, 0.0)
+    start = (prev.distance or 0.0) if prev is not None else 0.0
+    cumulative = start + np.cumsum(steps_m) / 1000
+
+    for position, speed, distance in zip(positions, speeds.tolist(), cumulative.tolist()):
+        position.speed = round(speed, 2)
+        position.distance = round(distance, 2)
+    return float(steps_m.sum()) / 1000
@@ -0,0 +1,161 @@
+import csv
+import heapq
+import io
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+from app_run.models import Run, Position, RunTrack
+
+# Потоковая выгрузка забегов и треков для аналитики: строки читаются из базы через
+# values_list().iterator(chunk_size) и уходят в ответ пачками по мере чтения,
+# поэтому память не зависит от размера выгрузки. Форматы: csv, ndjson и gpx (только треки).
+# Точки архивных забегов (app_run.archive) распаковываются из RunTrack по одному забегу за раз.
+
+CHUNK_SIZE = 2000
+RUN_COLUMNS = ['id', 'athlete_id', 'status', 'created_at', 'comment', 'distance', 'run_time_seconds', 'speed',
+               'track_distance', 'first_position_at', 'last_position_at']
+POSITION_COLUMNS = ['run_id', 'id', 'latitude', 'longitude', 'date_time', 'speed', 'distance']
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'gpx': 'application/gpx+xml; charset=utf-8',
+}
+GPX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n')
+
+
+def _date_bound(value, end):
+    # дата или дата-время ISO 8601; дата в date_to включает весь день
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+        lookup = 'lt' if end else 'gte'
+    else:
+        lookup = 'lte' if end else 'gte'
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return lookup, moment
+
+
+def filter_runs(params):
+    # забеги по query-параметрам athlete, status, date_from, date_to (по created_at)
+    runs = Run.objects.all()
+    errors = {}
+    athlete = params.get('athlete')
+    if athlete:
+        if athlete.isdigit():
+            runs = runs.filter(athlete_id=int(athlete))
+        else:
+            errors['athlete'] = 'id атлета - целое число'
+    status = params.get('status')
+    if status:
+        if status in dict(Run.STATUS):
+            runs = runs.filter(status=status)
+        else:
+            errors['status'] = f'Один из: {", ".join(dict(Run.STATUS))}'
+    for name in ('date_from', 'date_to'):
+        value = params.get(name)
+        if not value:
+            continue
+        bound = _date_bound(value, end=name == 'date_to')
+        if bound is None:
+            errors[name] = 'Дата YYYY-MM-DD или дата-время ISO 8601'
+        else:
+            lookup, moment = bound
+            runs = runs.filter(**{f'created_at__{lookup}': moment})
+    if errors:
+        raise ValidationError(errors)
+    return runs
+
+
+def run_rows(runs):
+    return runs.order_by('id').values_list(*RUN_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def archive_rows(runs):
+    from app_run.archive import archived_rows  # numpy нужен только для архивных забегов
+
+    run_ids = RunTrack.objects.filter(run__in=runs.values('id'), archived_at__isnull=False).order_by('run_id') \
+        .values_list('run_id', flat=True).iterator(chunk_size=CHUNK_SIZE)
+    for run_id in run_ids:
+        for row in archived_rows(run_id):
+            yield (run_id, *row)
+
+
+def track_rows(runs):
+    # точки подряд по забегам, в порядке записи (индекс run, id); архивные забеги вливаются по run_id
+    positions = Position.objects.filter(run__in=runs.values('id')).order_by('run_id', 'id')
+    hot = positions.values_list(*POSITION_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+    return heapq.merge(hot, archive_rows(runs), key=lambda row: row[0])
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def stream_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for index, row in enumerate(rows, 1):
+        writer.writerow([_plain(value) for value in row])
+        if index % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), cls=JSONEncoder, ensure_ascii=False))
+        if len(lines) == CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_gpx(rows):
+    # по треку <trk> на забег; rows - track_rows, отсортированные по забегу
+    parts = [GPX_HEADER]
+    current_run = None
+    for run_id, _, latitude, longitude, date_time, _, _ in rows:
+        if run_id != current_run:
+            if current_run is not None:
+                parts.append('</trkseg></trk>\n')
+            parts.append(f'<trk><name>Run {run_id}</name><trkseg>\n')
+            current_run = run_id
+        moment = f'<time>{date_time.isoformat()}</time>' if date_time else ''
+        parts.append(f'<trkpt lat="{latitude}" lon="{longitude}">{moment}</trkpt>\n')
+        if len(parts) >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts = []
+    if current_run is not None:
+        parts.append('</trkseg></trk>\n')
+    parts.append('</gpx>\n')
+    yield ''.join(parts)
+
+
+def export_stream(kind, fmt, runs):
+    # генератор выгрузки или None, если формат для этого вида данных не поддерживается
+    if kind == 'runs':
+        columns, rows = RUN_COLUMNS, run_rows(runs)
+    else:
+        columns, rows = POSITION_COLUMNS, track_rows(runs)
+    if fmt == 'csv':
+        return stream_csv(columns, rows)
+    if fmt == 'ndjson':
+        return stream_ndjson(columns, rows)
+    if fmt == 'gpx' and kind == 'tracks':
+        return stream_gpx(rows)
+    return None
@@ -0,0 +1,102 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app_run.buffer import check_flushed
+from app_run.caching import bump_version
+from app_run.challenges import award_challenges
+from app_run.models import Run, RunFinalizeJob
+from app_run.totals import apply_run_totals, add_run_to_athlete_stats
+
+# Постобработка забега после stop выполняется не в запросе, а воркером:
+# StartView ставит задачу RunFinalizeJob, python manage.py run_finalize_worker разбирает очередь.
+# Клиент узнаёт о готовности по полю Run.finalize_status.
+
+RETRY_DELAY_SECONDS = 10  # пауза перед повтором, удваивается с каждой неудачной попыткой
+
+
+def enqueue_finalize(run):
+    return RunFinalizeJob.objects.create(run=run)
+
+
+def finalize_run(run_id):
+    # переносит накопленные итоги в забег и проверяет челленджи; повторный вызов ничего не делает.
+    # Пока точки забега ждут записи в журналах (app_run.buffer), бросает PendingPoints - задача повторится
+    check_flushed(run_id)
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(pk=run_id)
+        if run.finalize_status == RunFinalizeJob.DONE:
+            return
+        apply_run_totals(run)
+        run.save(update_fields=['distance', 'run_time_seconds', 'speed'])
+        award_challenges(add_run_to_athlete_stats(run))
+        from app_run.heatmap import add_run_to_heatmap  # numpy нужен только здесь
+        from app_run.splits import save_run_splits
+        from app_run.archive import archive_run
+        from app_run.tracks import save_run_track
+
+        if settings.STORE_RUN_TRACKS and settings.ARCHIVE_ON_FINALIZE:
+            archive_run(run_id)  # трек вместо строк Position
+        elif settings.STORE_RUN_TRACKS:
+            save_run_track(run_id)
+        # после RunTrack: трек читается из него одной строкой
+        save_run_splits(run_id)
+        add_run_to_heatmap(run_id)
+        run.finalize_status = RunFinalizeJob.DONE
+        run.save(update_fields=['finalize_status'])
+
+
+def requeue_stale_jobs(stale_after):
+    # задачи, зависшие в processing (воркер упал), возвращаются в очередь
+    border = timezone.now() - timedelta(seconds=stale_after)
+    return RunFinalizeJob.objects.filter(status=RunFinalizeJob.PROCESSING, locked_at__lt=border).update(
+        status=RunFinalizeJob.PENDING, locked_at=None
+    )
+
+
+def process_next_job(max_attempts):
+    # берёт и выполняет одну готовую задачу, возвращает False, если брать нечего
+    now = timezone.now()
+    job = RunFinalizeJob.objects.filter(status=RunFinalizeJob.PENDING, run_after__lte=now) \
+        .order_by('run_after', 'id').first()
+    if job is None:
+        return False
+    # захват условным UPDATE: из нескольких воркеров задачу получит только один
+    claimed = RunFinalizeJob.objects.filter(pk=job.pk, status=RunFinalizeJob.PENDING).update(
+        status=RunFinalizeJob.PROCESSING, locked_at=now, attempts=F('attempts') + 1
+    )
+    if not claimed:
+        return True
+
+    attempts = job.attempts + 1
+    try:
+        finalize_run(job.run_id)
+    except Exception as exc:
+        if attempts >= max_attempts:
+            RunFinalizeJob.objects.filter(pk=job.pk).update(status=RunFinalizeJob.FAILED, last_error=repr(exc))
+            Run.objects.filter(pk=job.run_id).update(finalize_status=RunFinalizeJob.FAILED)
+            bump_version(Run)
+        else:
+            retry_at = timezone.now() + timedelta(seconds=RETRY_DELAY_SECONDS * 2 ** (attempts - 1))
+            RunFinalizeJob.objects.filter(pk=job.pk).update(
+                status=RunFinalizeJob.PENDING, run_after=retry_at, locked_at=None, last_error=repr(exc)
+            )
+        return True
+
+    RunFinalizeJob.objects.filter(pk=job.pk).update(status=RunFinalizeJob.DONE, locked_at=None)
+    return True
+
+
+def work(max_attempts=5, poll_interval=1.0, stale_after=300, once=False):
+    # цикл одного процесса воркера; с once=True выходит, когда очередь опустела
+    while True:
+        if process_next_job(max_attempts):
+            continue
+        if once:
+            return
+        requeue_stale_jobs(stale_after)
+        time.sleep(poll_interval)
@@ -0,0 +1,182 @@
+import io
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from app_run.caching import bump_version
+from app_run.distance import track_steps
+from app_run.finalize import finalize_run
+from app_run.models import Run, Position, RunFinalizeJob
+
+# Импорт истории забегов из GPX: каждый <trk> файла становится законченным забегом атлета.
+# Разбор XML и векторный расчёт скорости/дистанции идут в пуле процессов (measure_file),
+# запись в базу - в основном процессе: bulk_create забегов и точек, затем обычная постобработка
+# (итоги атлета, челленджи, RunTrack). Предметы CollectibleItem при импорте не собираются.
+
+POSITION_BATCH_SIZE = 1000
+
+
+def _archive_members(archive, name):
+    # gpx-файлы архива; размер после распаковки проверяется по оглавлению до чтения (защита от zip-бомб)
+    members = [member for member in archive.infolist()
+               if not member.is_dir() and member.filename.lower().endswith('.gpx')]
+    if len(members) > settings.GPX_MAX_FILES:
+        raise ValueError(f'{name}: в архиве больше {settings.GPX_MAX_FILES} gpx-файлов')
+    for member in members:
+        if member.file_size > settings.GPX_MAX_FILE_BYTES:
+            raise ValueError(f'{name}/{member.filename}: больше {settings.GPX_MAX_FILE_BYTES} байт после распаковки')
+    return members
+
+
+def _read_member(archive, member):
+    # читается не больше предела, даже если размер в оглавлении занижен
+    with archive.open(member) as stream:
+        data = stream.read(settings.GPX_MAX_FILE_BYTES + 1)
+    if len(data) > settings.GPX_MAX_FILE_BYTES:
+        raise ValueError(f'{member.filename}: больше {settings.GPX_MAX_FILE_BYTES} байт после распаковки')
+    return data
+
+
+def iter_sources(files):
+    # (имя, содержимое) каждого gpx: обычные файлы как есть, zip-архивы раскрываются.
+    # Оглавления всех архивов проверяются до первого файла: при превышении GPX_MAX_FILES/GPX_MAX_FILE_BYTES
+    # ValueError, и из этого набора ничего не импортируется
+    archives = []
+    for file in files:
+        name = getattr(file, 'name', '') or 'upload'
+        if zipfile.is_zipfile(file):
+            file.seek(0)
+            archive = zipfile.ZipFile(file)  # close() архива не закрывает сам file
+            archives.append((name, file, archive, _archive_members(archive, name)))
+        else:
+            archives.append((name, file, None, None))
+    for name, file, archive, members in archives:
+        if archive is None:
+            file.seek(0)
+            yield name, file.read()
+            continue
+        with archive:
+            for member in members:
+                yield f'{name}/{member.filename}', _read_member(archive, member)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]  # без пространства имён GPX 1.0/1.1
+
+
+def _parse_time(text):
+    if not text:
+        return None
+    moment = datetime.fromisoformat(text.strip())
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def parse_gpx(data):
+    # точки (latitude, longitude, время или None) по трекам файла, сегменты трека склеиваются
+    tracks = []
+    points = []
+    for _, element in ElementTree.iterparse(io.BytesIO(data)):
+        tag = _local_name(element.tag)
+        if tag == 'trkpt':
+            latitude, longitude = float(element.get('lat')), float(element.get('lon'))
+            if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+                raise ValueError(f'Координаты вне диапазона: {latitude}, {longitude}')
+            time = next((child.text for child in element if _local_name(child.tag) == 'time'), None)
+            points.append((latitude, longitude, _parse_time(time)))
+            element.clear()
+        elif tag == 'trk':
+            if points:
+                tracks.append(points)
+            points = []
+            element.clear()
+    return tracks
+
+
+def measure_file(source):
+    # выполняется в процессе пула, базу не трогает: (имя, треки, ошибка)
+    name, data = source
+    try:
+        tracks = parse_gpx(data)
+    except (ElementTree.ParseError, ValueError, TypeError) as error:
+        return name, [], str(error)
+    measured = []
+    for points in tracks:
+        positions = [Position(latitude=latitude, longitude=longitude, date_time=moment)
+                     for latitude, longitude, moment in points]
+        distance_km = track_steps(None, positions)
+        measured.append({
+            'distance': distance_km,
+            'points': [(p.latitude, p.longitude, p.date_time, p.speed, p.distance) for p in positions],
+        })
+    return name, measured, None
+
+
+def _measured(sources, processes):
+    if processes <= 1:
+        yield from map(measure_file, sources)
+        return
+    # соединение с базой нельзя делить между процессами
+    connections.close_all()
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork')) as pool:
+        batch = []
+        for source in sources:
+            batch.append(source)
+            if len(batch) == processes * 4:  # в памяти только текущая пачка файлов
+                yield from pool.map(measure_file, batch)
+                batch = []
+        yield from pool.map(measure_file, batch)
+
+
+def save_runs(athlete_id, name, tracks):
+    # забеги файла и их точки одной транзакцией, итоги забега уже посчитаны в measure_file
+    runs = []
+    for track in tracks:
+        times = [point[2] for point in track['points'] if point[2]]
+        speeds = [point[3] for point in track['points'] if point[3] is not None]
+        runs.append(Run(
+            athlete_id=athlete_id, comment=f'Импорт {name}', status=Run.FINISHED,
+            finalize_status=RunFinalizeJob.PENDING, track_distance=track['distance'],
+            first_position_at=min(times) if times else None, last_position_at=max(times) if times else None,
+            speed_sum=sum(speeds), speed_count=len(speeds),
+        ))
+    with transaction.atomic():
+        Run.objects.bulk_create(runs)
+        # created_at ставится auto_now_add, для истории это время начала забега
+        for run in runs:
+            run.created_at = run.first_position_at or run.created_at
+        Run.objects.bulk_update(runs, ['created_at'])
+        Position.objects.bulk_create(
+            (Position(run=run, latitude=latitude, longitude=longitude, date_time=moment, speed=speed,
+                      distance=distance)
+             for run, track in zip(runs, tracks)
+             for latitude, longitude, moment, speed, distance in track['points']),
+            batch_size=POSITION_BATCH_SIZE,
+        )
+        bump_version(Run, Position)
+        if settings.RUN_FINALIZE_ASYNC:
+            RunFinalizeJob.objects.bulk_create([RunFinalizeJob(run=run) for run in runs])
+    if not settings.RUN_FINALIZE_ASYNC:
+        for run in runs:
+            finalize_run(run.id)
+    return runs
+
+
+def import_gpx(athlete_id, sources, processes=1):
+    # sources - пары (имя, содержимое gpx), см. iter_sources; файлы с ошибкой пропускаются
+    report = {'runs': [], 'points': 0, 'errors': []}
+    for name, tracks, error in _measured(sources, processes):
+        if error is not None:
+            report['errors'].append({'file': name, 'error': error})
+            continue
+        if not tracks:
+            report['errors'].append({'file': name, 'error': 'В файле нет точек трека'})
+            continue
+        runs = save_runs(athlete_id, name, tracks)
+        report['runs'] += [run.id for run in runs]
+        report['points'] += sum(len(track['points']) for track in tracks)
+    return report
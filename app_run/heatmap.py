@@ -0,0 +1,82 @@
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from app_run.caching import bump_version
+from app_run.models import Run, HeatmapCell, RunFinalizeJob
+from app_run.tracks import run_track_points
+
+# Тепловая карта забегов для веб-карты: счётчики по ячейкам тайлов Web Mercator на каждом zoom
+# от 0 до HEATMAP_MAX_ZOOM. Тайл делится на HEATMAP_CELLS x HEATMAP_CELLS ячеек, у ячейки
+# глобальные координаты на своём zoom (x, y от 0 до 2^zoom * HEATMAP_CELLS).
+# runs - сколько забегов прошло через ячейку, points - сколько в ней точек.
+# Забег добавляется в постобработке (app_run.finalize) одним UPSERT с прибавлением счётчиков,
+# /api/heatmap/<z>/<x>/<y>/ читает готовые ячейки тайла. Удалённые забеги из карты не вычитаются -
+# python manage.py rebuild_heatmap пересобирает её с нуля.
+
+MAX_LATITUDE = 85.05112878  # граница Web Mercator
+UPSERT_BATCH = 1000
+
+
+def mercator(latitudes, longitudes):
+    # доли мира по x и y от 0 до 1, y растёт на юг, как у тайлов карты
+    latitudes = np.radians(np.clip(np.asarray(latitudes, dtype=float), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(latitudes) + 1.0 / np.cos(latitudes)) / np.pi) / 2.0
+    return x, y
+
+
+def run_cells(points):
+    # {(zoom, x, y): точек} по треку: ячейки самого крупного zoom считаются один раз,
+    # ячейки мельче получаются сдвигом координат, по zoom за проход np.unique
+    if not points:
+        return {}
+    max_zoom = settings.HEATMAP_MAX_ZOOM
+    side = 2 ** max_zoom * settings.HEATMAP_CELLS
+    x, y = mercator([p['latitude'] for p in points], [p['longitude'] for p in points])
+    cell_x = np.minimum((x * side).astype(np.int64), side - 1)
+    cell_y = np.minimum((y * side).astype(np.int64), side - 1)
+    cells = {}
+    for zoom in range(max_zoom + 1):
+        shift = max_zoom - zoom
+        pairs, counts = np.unique(np.stack([cell_x >> shift, cell_y >> shift], axis=1), axis=0, return_counts=True)
+        cells.update({(zoom, int(cx), int(cy)): int(count) for (cx, cy), count in zip(pairs, counts)})
+    return cells
+
+
+def _upsert(cells):
+    # INSERT ... ON CONFLICT DO UPDATE прибавляет к счётчикам: параллельные постобработки не теряют друг друга
+    # (одинаковый синтаксис у SQLite и PostgreSQL)
+    table = connection.ops.quote_name(HeatmapCell._meta.db_table)
+    sql = (f'INSERT INTO {table} (zoom, x, y, runs, points) VALUES (%s, %s, %s, %s, %s) '
+           f'ON CONFLICT (zoom, x, y) DO UPDATE SET runs = {table}.runs + excluded.runs, '
+           f'points = {table}.points + excluded.points')
+    rows = [(zoom, x, y, 1, count) for (zoom, x, y), count in sorted(cells.items())]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH):
+            cursor.executemany(sql, rows[start:start + UPSERT_BATCH])
+
+
+def add_run_to_heatmap(run_id):
+    # вызывается в транзакции постобработки после RunTrack, трек читается из него
+    cells = run_cells(run_track_points(run_id))
+    if cells:
+        _upsert(cells)
+        bump_version(HeatmapCell)
+    return len(cells)
+
+
+def rebuild_heatmap():
+    # карта с нуля по всем обработанным законченным забегам; возвращает число забегов
+    run_ids = Run.objects.filter(status=Run.FINISHED, finalize_status=RunFinalizeJob.DONE) \
+        .order_by('id').values_list('id', flat=True)
+    with transaction.atomic():
+        HeatmapCell.objects.all().delete()  # у HeatmapCell нет сигналов удаления - один DELETE
+        count = 0
+        for run_id in run_ids.iterator(chunk_size=500):
+            cells = run_cells(run_track_points(run_id))
+            if cells:
+                _upsert(cells)
+            count += 1
+        bump_version(HeatmapCell)
+    return count
@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+import tempfile
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from rest_framework.utils.encoders import JSONEncoder
+
+from app_run.caching import bump_version, COLLECTIBLE_CELLS
+from app_run.models import CollectibleItem
+from app_run.spatial import grid_cell
+
+# Потоковый импорт CollectibleItem из xlsx/csv: строки читаются по одной,
+# проверяются без DRF-сериализатора и пишутся пачками с upsert по uid.
+# Память не растёт с размером файла - в ней только текущая пачка, а битые строки
+# копятся во временном файле. Импорт заканчивается до ответа и не зависит от того, дочитает ли его клиент.
+
+COLUMNS = ['name', 'uid', 'value', 'latitude', 'longitude', 'picture']
+CHUNK_SIZE = 1000
+UPDATE_FIELDS = ['name', 'value', 'latitude', 'longitude', 'picture', 'cell']
+BROKEN_SPOOL_SIZE = 1024 * 1024  # битые строки до 1 МБ держим в памяти, дальше - на диске
+
+validate_url = URLValidator()
+
+
+def iter_rows(file):
+    # строки файла без заголовка; csv определяется по расширению или content-type
+    name = (getattr(file, 'name', '') or '').lower()
+    if name.endswith('.csv') or getattr(file, 'content_type', '') == 'text/csv':
+        reader = csv.reader(io.TextIOWrapper(file.file, encoding='utf-8-sig', newline=''))
+        next(reader, None)
+        yield from (tuple(row) for row in reader)
+        return
+
+    import openpyxl  # тяжёлый импорт, нужен только для xlsx
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True, min_row=2)
+    finally:
+        workbook.close()
+
+
+def _text(value):
+    if value is None or isinstance(value, bool):
+        raise ValueError
+    value = str(value).strip()
+    if not value:
+        raise ValueError
+    return value
+
+
+def _integer(value):
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError
+    return int(number)
+
+
+def _coordinate(value, limit):
+    number = float(value)
+    if not -limit <= number <= limit:
+        raise ValueError
+    return number
+
+
+def clean_row(row):
+    # те же правила, что у CollectibleSerializer; None - строка битая
+    if len(row) < len(COLUMNS):
+        return None
+    try:
+        data = {
+            'name': _text(row[0]),
+            'uid': _text(row[1]),
+            'value': _integer(row[2]),
+            'latitude': _coordinate(row[3], 90.0),
+            'longitude': _coordinate(row[4], 180.0),
+            'picture': _text(row[5]),
+        }
+        validate_url(data['picture'])
+    except (TypeError, ValueError, ValidationError):
+        return None
+    return data
+
+
+def save_chunk(rows):
+    # upsert по uid: существующие предметы обновляются, новые создаются, оба действия пачкой
+    by_uid = {}
+    for data in rows:
+        by_uid[data['uid']] = data  # при повторе uid внутри пачки побеждает последняя строка
+    existing = {item.uid: item for item in CollectibleItem.objects.filter(uid__in=by_uid)}
+
+    to_create, to_update = [], []
+    for uid, data in by_uid.items():
+        item = existing.get(uid) or CollectibleItem(uid=uid)
+        for field, value in data.items():
+            setattr(item, field, value)
+        item.cell = grid_cell(item.latitude, item.longitude)  # bulk-операции не вызывают save()
+        (to_update if item.pk else to_create).append(item)
+
+    CollectibleItem.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+    CollectibleItem.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=CHUNK_SIZE)
+    bump_version(CollectibleItem, COLLECTIBLE_CELLS)
+
+
+def import_collectibles(file, chunk_size=CHUNK_SIZE):
+    # импортирует файл целиком и возвращает итератор по битым строкам
+    broken = tempfile.SpooledTemporaryFile(max_size=BROKEN_SPOOL_SIZE, mode='w+', encoding='utf-8')
+    chunk = []
+    for row in iter_rows(file):
+        data = clean_row(row)
+        if data is None:
+            broken.write(json.dumps(list(row), cls=JSONEncoder, ensure_ascii=False) + '\n')
+            continue
+        chunk.append(data)
+        if len(chunk) >= chunk_size:
+            save_chunk(chunk)
+            chunk = []
+    if chunk:
+        save_chunk(chunk)
+    broken.seek(0)
+    return _read_broken(broken)
+
+
+def _read_broken(spool):
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def stream_json_list(items):
+    # JSON-массив по частям, чтобы не собирать весь ответ в памяти
+    yield '['
+    for index, item in enumerate(items):
+        yield (',' if index else '') + json.dumps(item, cls=JSONEncoder, ensure_ascii=False)
+    yield ']'
@@ -0,0 +1,171 @@
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from app_run.buffer import buffered_points
+from app_run.caching import model_versions, COLLECTIBLE_CELLS
+from app_run.models import Run, Position, CollectibleItem
+
+# Состояние приёма точек забега в кэше: статус и атлет забега, последняя записанная точка
+# и id предметов, которые у атлета уже есть. С ним запись точки не читает из базы ни забег,
+# ни предыдущую точку, ни предметы рядом - остаются INSERT точки и UPDATE итогов забега.
+# Состояние забывается сигналами (app_run.signals) после коммита сохранения забега и правки/удаления
+# точек, новые точки записывают в него сами view после INSERT. Кэш должен быть общим для всех
+# серверов (CACHES в production), иначе каждый сервер цепляет точки к своей устаревшей последней точке.
+#
+# forget не только удаляет состояние, но и меняет поколение забега (GENERATION_KEY). Запрос, который
+# прочёл базу до коммита stop и положил состояние в кэш уже после forget, записывает его со старым
+# поколением - такое состояние при следующем чтении не принимается и перечитывается из базы.
+
+SESSION_KEY = 'ingest:{}'
+GENERATION_KEY = 'ingest-generation:{}'
+CELL_KEY = 'collectible-cell:{}:{}'  # версия COLLECTIBLE_CELLS, ячейка
+LAST_FIELDS = ['latitude', 'longitude', 'date_time', 'distance']
+
+
+def _run_query(run_id):
+    return Run.objects.filter(pk=run_id).values('status', 'athlete_id')
+
+
+def _last_query(run_id):
+    return Position.objects.filter(run_id=run_id).order_by('-id').values(*LAST_FIELDS)
+
+
+def _collected_query(athlete_id):
+    return CollectibleItem.users.through.objects.filter(user_id=athlete_id).values_list('collectibleitem_id', flat=True)
+
+
+def _buffered_last(run_id):
+    # при отложенной записи (app_run.buffer) последняя точка может быть ещё не в базе
+    points = buffered_points(run_id)
+    return {field: points[-1][field] for field in LAST_FIELDS} if points else None
+
+
+def _load_session(run_id):
+    run = _run_query(run_id).first()
+    if run is None:
+        return None
+    last = _buffered_last(run_id) or _last_query(run_id).first()
+    return {**run, 'last': last, 'collected': set(_collected_query(run['athlete_id']))}
+
+
+async def _aload_session(run_id):
+    run = await _run_query(run_id).afirst()
+    if run is None:
+        return None
+    last = _buffered_last(run_id) or await _last_query(run_id).afirst()
+    collected = {item_id async for item_id in _collected_query(run['athlete_id'])}
+    return {**run, 'last': last, 'collected': collected}
+
+
+def _keys(run_id):
+    return SESSION_KEY.format(run_id), GENERATION_KEY.format(run_id)
+
+
+def _generation_timeout():
+    # поколение живёт дольше состояния, записанного при нём
+    return settings.INGEST_SESSION_TIMEOUT * 2
+
+
+def get_session(run_id):
+    # состояние забега из кэша, при промахе или смене поколения - из базы; None, если забега нет
+    key, generation_key = _keys(run_id)
+    cached = cache.get_many([key, generation_key])
+    state, generation = cached.get(key), cached.get(generation_key)
+    if state is None or state.get('generation') != generation:
+        state = _load_session(run_id)
+        if state is not None:
+            state['generation'] = generation
+            cache.set(key, state, settings.INGEST_SESSION_TIMEOUT)
+    return state
+
+
+async def aget_session(run_id):
+    # то же для асинхронных view (app_run.async_views): async ORM и async API кэша
+    key, generation_key = _keys(run_id)
+    cached = await cache.aget_many([key, generation_key])
+    state, generation = cached.get(key), cached.get(generation_key)
+    if state is None or state.get('generation') != generation:
+        state = await _aload_session(run_id)
+        if state is not None:
+            state['generation'] = generation
+            await cache.aset(key, state, settings.INGEST_SESSION_TIMEOUT)
+    return state
+
+
+def save_session(run_id, state):
+    cache.set(SESSION_KEY.format(run_id), state, settings.INGEST_SESSION_TIMEOUT)
+
+
+def forget_session(run_id):
+    key, generation_key = _keys(run_id)
+    cache.set(generation_key, secrets.token_hex(8), _generation_timeout())
+    cache.delete(key)
+
+
+async def aforget_session(run_id):
+    key, generation_key = _keys(run_id)
+    await cache.aset(generation_key, secrets.token_hex(8), _generation_timeout())
+    await cache.adelete(key)
+
+
+def session_run(run_id, state):
+    # несохраняемая заготовка Run с полями из состояния - для FK новой точки и проверки статуса
+    return Run(id=run_id, status=state['status'], athlete_id=state['athlete_id'])
+
+
+def last_position(run_id, state):
+    # предыдущая точка забега для track_steps
+    return Position(run_id=run_id, **state['last']) if state['last'] else None
+
+
+def remember_positions(run_id, positions):
+    # после коммита INSERT последней точкой забега становится последняя из записанных;
+    # при откате транзакции состояние не меняется
+    last = {field: getattr(positions[-1], field) for field in LAST_FIELDS}
+    transaction.on_commit(lambda: _update_session(run_id, last=last))
+
+
+def remember_collected(run_id, item_ids):
+    # после коммита добавляет предметы к собранным атлетом
+    transaction.on_commit(lambda: _update_session(run_id, collected=item_ids))
+
+
+async def aremember_positions(run_id, positions):
+    # асинхронный путь пишет без транзакции (autocommit), состояние обновляется сразу
+    state = await aget_session(run_id)
+    if state is not None:
+        state['last'] = {field: getattr(positions[-1], field) for field in LAST_FIELDS}
+        await cache.aset(SESSION_KEY.format(run_id), state, settings.INGEST_SESSION_TIMEOUT)
+
+
+def _update_session(run_id, last=None, collected=()):
+    state = get_session(run_id)
+    if state is None:
+        return
+    if last is not None:
+        state['last'] = last
+    state['collected'].update(collected)
+    save_session(run_id, state)
+
+
+def cell_items(cells):
+    # предметы по ячейкам сетки: {ячейка: [(id, latitude, longitude), ...]},
+    # кэш привязан к версии COLLECTIBLE_CELLS: она меняется при сохранении и удалении предметов,
+    # но не при их сборе атлетами
+    version, = model_versions([COLLECTIBLE_CELLS])
+    keys = {CELL_KEY.format(version, cell): cell for cell in cells}
+    cached = cache.get_many(keys)
+    result = {keys[key]: items for key, items in cached.items()}
+    missing = [cell for key, cell in keys.items() if key not in cached]
+    if missing:
+        loaded = {cell: [] for cell in missing}
+        rows = CollectibleItem.objects.filter(cell__in=missing).values_list('id', 'cell', 'latitude', 'longitude')
+        for item_id, cell, latitude, longitude in rows:
+            loaded[cell].append((item_id, latitude, longitude))
+        cache.set_many({CELL_KEY.format(version, cell): items for cell, items in loaded.items()},
+                       settings.INGEST_SESSION_TIMEOUT)
+        result.update(loaded)
+    return result
@@ -0,0 +1,223 @@
+import asyncio
+import json
+from collections import deque
+import queue
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from app_run.models import Run, Position
+
+# Живая лента точек забегов через Server-Sent Events вместо опроса /api/positions/?run=<id>.
+# Новые точки публикуются в broadcaster этого процесса после коммита записи, подписчики
+# получают только их. Клиент возобновляет ленту с последнего полученного id (заголовок
+# Last-Event-ID, который EventSource шлёт сам, или ?last_id=), пропущенное дочитывается из базы.
+# Транзакции коммитятся не по порядку id, поэтому лента отсекает не «id меньше последнего», а уже
+# отправленные id (Delivered), и после каждой пачки событий и в тишине дочитывает из базы то,
+# что не пришло в broadcaster: точки других процессов и закоммиченные позже точек с большим id.
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'  # как у PositionSerializer.date_time
+EVENT_FIELDS = ['id', 'run_id', 'run__athlete_id', 'latitude', 'longitude', 'date_time', 'speed', 'distance']
+
+
+class Subscription:
+    # очередь событий одного подписчика: обычная для синхронного потока,
+    # asyncio.Queue своего event loop для ASGI
+    def __init__(self, match, loop=None):
+        self.match = match
+        self.loop = loop
+        self.queue = asyncio.Queue() if loop is not None else queue.SimpleQueue()
+
+    def push(self, event):
+        if self.loop is None:
+            self.queue.put(event)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass  # event loop подписчика уже закрыт
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def aget(self, timeout):
+        if not timeout:
+            try:
+                return self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broadcaster:
+    # подписчики в памяти процесса; match(event) решает, нужно ли событие подписчику
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, match, loop=None):
+        subscription = Subscription(match, loop)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for event in events:
+            for subscription in subscriptions:
+                if subscription.match(event):
+                    subscription.push(event)
+
+
+broadcaster = Broadcaster()
+
+
+def _event(position_id, run_id, athlete_id, latitude, longitude, date_time, speed, distance):
+    return {
+        'id': position_id,
+        'run': run_id,
+        'athlete': athlete_id,
+        'latitude': latitude,
+        'longitude': longitude,
+        'date_time': date_time.strftime(DATE_FORMAT) if date_time else None,
+        'speed': speed,
+        'distance': distance,
+    }
+
+
+def position_events(athlete_id, positions):
+    return [_event(p.id, p.run_id, athlete_id, p.latitude, p.longitude, p.date_time, p.speed, p.distance)
+            for p in positions]
+
+
+def publish_positions(athlete_id, positions):
+    # после коммита: подписчики не увидят точки откаченной транзакции
+    events = position_events(athlete_id, positions)
+    transaction.on_commit(lambda: broadcaster.publish(events))
+
+
+class Feed:
+    # что смотрит подписчик: один забег или забеги в процессе у группы атлетов (группа тренера)
+    def __init__(self, run_id=None, athlete_ids=None):
+        self.run_id = run_id
+        self.athlete_ids = set(athlete_ids or ())
+
+    def match(self, event):
+        if self.run_id is not None:
+            return event['run'] == self.run_id
+        return event['athlete'] in self.athlete_ids
+
+    def positions(self):
+        if self.run_id is not None:
+            return Position.objects.filter(run_id=self.run_id)
+        return Position.objects.filter(run__athlete_id__in=self.athlete_ids, run__status=Run.IN_PROGRESS)
+
+    def start_id(self, last_id):
+        # без возобновления лента начинается с текущей последней точки
+        if last_id is not None:
+            return last_id
+        return self.positions().order_by('-id').values_list('id', flat=True).first() or 0
+
+    def backlog(self, last_id):
+        # точки после last_id из базы: при возобновлении и записанные другими процессами
+        rows = self.positions().filter(id__gt=last_id).order_by('id').values_list(*EVENT_FIELDS)
+        return [_event(*row) for row in rows[:settings.LIVE_BACKLOG_LIMIT]]
+
+    def unsent(self, delivered, after):
+        # страница точек из базы после after, которые ещё не отправлены, и с какого id читать дальше (None - всё)
+        events = self.backlog(after)
+        more = events[-1]['id'] if len(events) == settings.LIVE_BACKLOG_LIMIT else None
+        return delivered.fresh(events), more
+
+
+class Delivered:
+    # id, уже отправленные подписчику: floor - всё до него отправлено или больше не ждём,
+    # выше floor помним последние LIVE_SENT_WINDOW отправленных id
+    def __init__(self, floor):
+        self.floor = floor
+        self.order = deque()
+        self.ids = set()
+
+    def fresh(self, events):
+        # ещё не отправленные события по возрастанию id, они отмечаются отправленными
+        result = []
+        for event in sorted(events, key=lambda item: item['id']):
+            if event['id'] <= self.floor or event['id'] in self.ids:
+                continue
+            self.ids.add(event['id'])
+            self.order.append(event['id'])
+            result.append(event)
+        while len(self.order) > settings.LIVE_SENT_WINDOW:
+            oldest = self.order.popleft()
+            self.ids.discard(oldest)
+            self.floor = max(self.floor, oldest)
+        return result
+
+
+def _message(event):
+    return f'id: {event["id"]}\nevent: position\ndata: {json.dumps(event)}\n\n'
+
+
+def event_stream(feed, last_id):
+    # синхронный генератор для WSGI: держит поток воркера, пока клиент подключён
+    subscription = broadcaster.subscribe(feed.match)  # до чтения базы, чтобы не потерять точки между ними
+    try:
+        delivered = Delivered(feed.start_id(last_id))
+        yield f'retry: {settings.LIVE_RETRY_MS}\n\n'
+        while True:
+            after = delivered.floor
+            while after is not None:
+                events, after = feed.unsent(delivered, after)
+                for event in events:
+                    yield _message(event)
+            event = subscription.get(settings.LIVE_HEARTBEAT_SECONDS)
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            events = []
+            while event is not None:
+                events.append(event)
+                event = subscription.get(0)
+            for event in delivered.fresh(events):
+                yield _message(event)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def async_event_stream(feed, last_id):
+    # то же для ASGI: ожидание событий не занимает поток
+    subscription = broadcaster.subscribe(feed.match, loop=asyncio.get_running_loop())
+    try:
+        delivered = Delivered(await sync_to_async(feed.start_id)(last_id))
+        yield f'retry: {settings.LIVE_RETRY_MS}\n\n'
+        while True:
+            after = delivered.floor
+            while after is not None:
+                events, after = await sync_to_async(feed.unsent)(delivered, after)
+                for event in events:
+                    yield _message(event)
+            event = await subscription.aget(settings.LIVE_HEARTBEAT_SECONDS)
+            if event is None:
+                yield ': ping\n\n'
+                continue
+            events = []
+            while event is not None:
+                events.append(event)
+                event = await subscription.aget(0)
+            for event in delivered.fresh(events):
+                yield _message(event)
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.archive import archive_candidates, archive_run
+
+
+class Command(BaseCommand):
+    # оставляет забегам, законченным больше --days дней назад, только сжатый трек RunTrack, строки Position удаляет;
+    # каждый забег - своей транзакцией, прерванный запуск можно просто повторить
+    help = 'Переносит точки давно законченных забегов в сжатый трек без потерь (RunTrack)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='архивировать забеги старше стольких дней')
+        parser.add_argument('--limit', type=int, help='не больше стольких забегов за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='только показать, сколько забегов подходит')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError('--days не может быть отрицательным')
+        run_ids = archive_candidates(options['days']).values_list('id', flat=True)
+        if options['limit']:
+            run_ids = run_ids[:options['limit']]
+        run_ids = list(run_ids)
+        if options['dry_run']:
+            self.stdout.write(f'Забегов к архивации: {len(run_ids)}')
+            return
+
+        points = 0
+        for run_id in run_ids:
+            points += archive_run(run_id)
+        self.stdout.write(self.style.SUCCESS(f'В архив перенесено забегов: {len(run_ids)}, точек: {points}'))
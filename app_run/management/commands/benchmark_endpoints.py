@@ -0,0 +1,181 @@
+import json
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from app_run.caching import bump_version
+from app_run.models import Run, Position, CollectibleItem, HeatmapCell
+from app_run.signals import VERSIONED_MODELS
+
+
+class Command(BaseCommand):
+    # прогоняет все маршруты project_run/urls.py через тестовый клиент на текущей базе
+    # (данные готовит generate_data) и печатает JSON: p50/p95 латентности, запросы к базе и байты ответа
+    # пишущие запросы выполняются в транзакции, которая в конце откатывается - база не меняется.
+    # Живая лента бесконечна: у неё замеряется время до первой точки из базы при переподключении
+    help = 'Бенчмарк эндпоинтов: латентность, количество запросов и размер ответа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='повторов каждого запроса')
+        parser.add_argument('--cold-cache', action='store_true', help='очищать кэш ответов перед каждым запросом')
+        parser.add_argument('--output', help='файл для JSON-отчёта, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        run = Run.objects.filter(status=Run.FINISHED).order_by('-id').first()
+        user = User.objects.filter(is_superuser=False, runs__isnull=False).order_by('-id').first()
+        if run is None or user is None:
+            raise CommandError('Нет данных: сначала python manage.py generate_data')
+        self.client = Client()
+        self.options = options
+
+        report = {}
+        with transaction.atomic():
+            endpoints = self.endpoints(run, user)
+            for name, method, url, payload in endpoints:
+                if method != 'stream':
+                    report[name] = self.measure(method, url, payload)
+            transaction.set_rollback(True)
+        for name, method, url, payload in endpoints:  # живая лента только читает
+            if method == 'stream':
+                report[name] = self.measure(method, url, payload)
+        # версии моделей в кэше откатом не вернуть: сбрасываем ответы, закэшированные по откаченным данным
+        bump_version(*VERSIONED_MODELS)
+
+        result = json.dumps({
+            'repeat': options['repeat'],
+            'cold_cache': options['cold_cache'],
+            'dataset': {
+                'users': User.objects.count(),
+                'runs': Run.objects.count(),
+                'positions': Position.objects.count(),
+                'collectibles': CollectibleItem.objects.count(),
+            },
+            'endpoints': report,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(result)
+        else:
+            self.stdout.write(result)
+
+    def endpoints(self, run, user):
+        # (имя, метод, url или функция -> url, тело или функция -> тело)
+        def fresh_run(status):
+            return Run.objects.create(athlete=user, comment='benchmark', status=status)
+
+        def heatmap_tile():
+            # тайл zoom 12 с ячейками тепловой карты, если она уже собрана
+            cell = HeatmapCell.objects.filter(zoom=12).order_by('-runs').first()
+            if cell is None:
+                return '/api/heatmap/0/0/0/'
+            return f'/api/heatmap/12/{cell.x // settings.HEATMAP_CELLS}/{cell.y // settings.HEATMAP_CELLS}/'
+
+        def position_payload(count):
+            def build():
+                target = fresh_run(Run.IN_PROGRESS)
+                return [{'run': target.id, 'latitude': 55.75 + i / 1e4, 'longitude': 37.62,
+                         'date_time': f'2024-01-01T10:{i // 60:02d}:{i % 60:02d}'} for i in range(count)]
+            return build
+
+        return [
+            ('company_details', 'get', '/api/company_details/', None),
+            ('runs_list', 'get', '/api/runs/', None),
+            ('runs_page', 'get', '/api/runs/?size=50', None),
+            ('runs_retrieve', 'get', f'/api/runs/{run.id}/', None),
+            ('runs_track', 'get', f'/api/runs/{run.id}/track/', None),
+            ('runs_track_zoom', 'get', f'/api/runs/{run.id}/track/?zoom=13', None),
+            ('runs_analytics', 'get', f'/api/runs/{run.id}/analytics/', None),
+            ('runs_start', 'post', lambda: f'/api/runs/{fresh_run(Run.INIT).id}/start/', None),
+            ('runs_stop', 'post', lambda: f'/api/runs/{fresh_run(Run.IN_PROGRESS).id}/stop/', None),
+            ('async_runs_start', 'post', lambda: f'/api/async/runs/{fresh_run(Run.INIT).id}/start/', None),
+            ('async_runs_stop', 'post', lambda: f'/api/async/runs/{fresh_run(Run.IN_PROGRESS).id}/stop/', None),
+            ('users_list', 'get', '/api/users/', None),
+            ('users_search', 'get', '/api/users/?search=Атлет1&type=athlete', None),
+            ('users_retrieve', 'get', f'/api/users/{user.id}/', None),
+            ('challenges_list', 'get', f'/api/challenges/?athlete={user.id}', None),
+            ('positions_run', 'get', f'/api/positions/?run={run.id}', None),
+            ('positions_page', 'get', f'/api/positions/?run={run.id}&size=50', None),
+            ('positions_create', 'post', '/api/positions/', lambda: position_payload(1)()[0]),
+            ('positions_batch_300', 'post', '/api/positions/', position_payload(300)),
+            ('async_positions_create', 'post', '/api/async/positions/', lambda: position_payload(1)()[0]),
+            ('live_run', 'stream', f'/api/live/runs/{run.id}/?last_id=0', None),
+            ('live_athletes', 'stream', f'/api/live/athletes/?athletes={user.id}&last_id=0', None),
+            ('collectibles_list', 'get', '/api/collectible_item/', None),
+            ('athlete_info', 'get', f'/api/athlete_info/{user.id}/', None),
+            ('upload_file_csv', 'post', '/api/upload_file/', 'csv'),
+            ('export_runs_csv', 'get', f'/api/export/runs/csv/?athlete={user.id}', None),
+            ('export_tracks_ndjson', 'get', f'/api/export/tracks/ndjson/?athlete={user.id}', None),
+            ('export_tracks_gpx', 'get', f'/api/export/tracks/gpx/?athlete={user.id}', None),
+            ('import_gpx', 'post', '/api/import_gpx/', {'gpx': user.id}),
+            ('heatmap_tile', 'get', heatmap_tile(), None),
+            ('heatmap_tile_not_modified', 'get', heatmap_tile(), 'etag'),
+            ('metrics', 'get', '/metrics', None),
+            ('admin_login', 'get', '/admin/login/', None),
+        ]
+
+    def request(self, method, url, payload):
+        url = url() if callable(url) else url
+        payload = payload() if callable(payload) else payload
+        if payload == 'csv':
+            rows = ['name,uid,value,latitude,longitude,picture'] + [
+                f'bench{i},bench-{i},{i},55.7,37.6,https://example.com/{i}.png' for i in range(100)
+            ]
+            upload = SimpleUploadedFile('bench.csv', '\n'.join(rows).encode(), content_type='text/csv')
+            return lambda: self.client.post(url, {'file': upload})
+        if isinstance(payload, dict) and 'gpx' in payload:
+            points = ''.join(f'<trkpt lat="{55.75 + i / 1e4}" lon="37.62"><time>2024-01-01T10:{i // 60:02d}:'
+                             f'{i % 60:02d}Z</time></trkpt>' for i in range(300))
+            gpx = f'<gpx><trk><trkseg>{points}</trkseg></trk></gpx>'.encode()
+            upload = SimpleUploadedFile('bench.gpx', gpx, content_type='application/gpx+xml')
+            return lambda: self.client.post(url, {'athlete': payload['gpx'], 'file': upload})
+        if payload == 'etag':
+            etag = self.client.get(url).headers.get('ETag', '')
+            return lambda: self.client.get(url, headers={'If-None-Match': etag})
+        if method == 'post':
+            return lambda: self.client.post(url, json.dumps(payload or {}), content_type='application/json')
+        return lambda: self.client.get(url)
+
+    def measure(self, method, url, payload):
+        latencies, queries, sizes, statuses = [], [], [], set()
+        for _ in range(self.options['repeat']):
+            send = self.request(method, url, payload)  # подготовка данных не входит в замер
+            if self.options['cold_cache']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                if method == 'stream':
+                    response, body = self.first_event(send)
+                else:
+                    response = send()
+                    body = b''.join(response.streaming_content) if response.streaming else response.content
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            sizes.append(len(body))
+            statuses.add(response.status_code)
+        return {
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+            'queries': round(float(np.mean(queries)), 1),
+            'bytes': round(float(np.mean(sizes))),
+            'status': sorted(statuses),
+        }
+
+    def first_event(self, send):
+        # лента читается до первого сообщения после retry (точки из базы или пинг без ожидания) и закрывается
+        with override_settings(LIVE_HEARTBEAT_SECONDS=0):
+            response = send()
+            body = b''
+            for chunk in response.streaming_content:
+                body += chunk
+                if not chunk.startswith(b'retry:'):
+                    break
+            response.close()  # закрывает и соединение с базой, поэтому лента замеряется вне транзакции
+        return response, body
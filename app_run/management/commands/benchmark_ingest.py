@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+
+from app_run.caching import bump_version
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    # параллельные клиенты пишут точки своих забегов (каждый последовательно) тремя путями:
+    #   wsgi       - синхронный /api/positions/ через WSGI-обработчик, пул из --threads потоков
+    #   asgi_sync  - тот же view через ASGI-обработчик (Django гоняет его в потоке)
+    #   asgi_async - /api/positions/ из app_run.async_views через ASGI в одном event loop
+    # обработчики вызываются в процессе, без HTTP-сервера; созданные забеги в конце удаляются
+    help = 'Бенчмарк приёма точек: WSGI против ASGI при параллельных клиентах'
+
+    MODES = [
+        ('wsgi', '/api/positions/'),
+        ('asgi_sync', '/api/positions/'),
+        ('asgi_async', '/api/async/positions/'),
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='параллельных клиентов, у каждого свой забег')
+        parser.add_argument('--points', type=int, default=30, help='точек от каждого клиента')
+        parser.add_argument('--threads', type=int, default=4, help='потоков WSGI-воркера')
+        parser.add_argument('--output', help='файл для JSON-отчёта, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        self.options = options
+        athlete = User.objects.create(username=f'benchmark-ingest-{time.time_ns()}')
+        report = {}
+        try:
+            for mode, url in self.MODES:
+                runs = [Run.objects.create(athlete=athlete, comment='benchmark', status=Run.IN_PROGRESS)
+                        for _ in range(options['clients'])]
+                started = time.perf_counter()
+                if mode == 'wsgi':
+                    results = self.drive_wsgi(url, runs)
+                else:
+                    results = asyncio.run(self.drive_asgi(url, runs))
+                report[mode] = self.summary(results, time.perf_counter() - started)
+        finally:
+            athlete.delete()  # забеги и точки удаляются каскадом
+            bump_version(Run)
+
+        result = json.dumps({
+            'clients': options['clients'],
+            'points': options['points'],
+            'threads': options['threads'],
+            'modes': report,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(result)
+        else:
+            self.stdout.write(result)
+
+    def payloads(self, run):
+        for i in range(self.options['points']):
+            yield json.dumps({'run': run.id, 'latitude': 55.75 + i / 1e4, 'longitude': 37.62,
+                              'date_time': f'2024-01-01T10:{i // 60 % 60:02d}:{i % 60:02d}'})
+
+    def drive_wsgi(self, url, runs):
+        def send_run(run):
+            client = Client()
+            results = []
+            for payload in self.payloads(run):
+                started = time.perf_counter()
+                response = client.post(url, payload, content_type='application/json')
+                results.append((time.perf_counter() - started, response.status_code))
+            return results
+
+        with ThreadPoolExecutor(self.options['threads']) as pool:
+            return [result for run_results in pool.map(send_run, runs) for result in run_results]
+
+    async def drive_asgi(self, url, runs):
+        async def send_run(run):
+            client = AsyncClient()
+            results = []
+            for payload in self.payloads(run):
+                started = time.perf_counter()
+                response = await client.post(url, payload, content_type='application/json')
+                results.append((time.perf_counter() - started, response.status_code))
+            return results
+
+        run_results = await asyncio.gather(*(send_run(run) for run in runs))
+        return [result for results in run_results for result in results]
+
+    def summary(self, results, elapsed):
+        latencies = [seconds * 1000 for seconds, _ in results]
+        return {
+            'requests': len(results),
+            'errors': sum(1 for _, status in results if status != 201),
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(results) / elapsed, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        }
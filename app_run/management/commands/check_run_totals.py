@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from app_run.models import Run
+from app_run.totals import TOTAL_FIELDS, apply_run_totals, recompute_run_totals
+
+DISTANCE_TOLERANCE_KM = 0.001
+SPEED_TOLERANCE = 0.01
+
+
+class Command(BaseCommand):
+    # сверяет накопленные итоги забегов с пересчётом по сырым точкам,
+    # с --fix записывает пересчитанные значения (законченным забегам обновляет и distance/время/скорость)
+    help = 'Сверяет накопленные итоги забегов с пересчётом по точкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', type=int, action='append', dest='runs', help='id забега, можно несколько раз')
+        parser.add_argument('--fix', action='store_true', help='записать пересчитанные итоги')
+
+    def handle(self, *args, **options):
+        runs = Run.objects.order_by('id')
+        if options['runs']:
+            runs = runs.filter(id__in=options['runs'])
+
+        mismatched = 0
+        for run in runs.iterator(chunk_size=500):
+            expected = recompute_run_totals(run.id)
+            diff = {field: (getattr(run, field), expected[field])
+                    for field in TOTAL_FIELDS if not self.same(field, getattr(run, field), expected[field])}
+            if not diff:
+                continue
+            mismatched += 1
+            details = ', '.join(f'{field}: {stored} != {actual}' for field, (stored, actual) in diff.items())
+            self.stdout.write(f'run {run.id}: {details}')
+            if options['fix']:
+                for field in TOTAL_FIELDS:
+                    setattr(run, field, expected[field])
+                update_fields = list(TOTAL_FIELDS)
+                if run.status == Run.FINISHED:
+                    apply_run_totals(run)
+                    update_fields += ['distance', 'run_time_seconds', 'speed']
+                run.save(update_fields=update_fields)
+
+        if mismatched:
+            action = 'исправлено' if options['fix'] else 'найдено расхождений'
+            self.stdout.write(self.style.WARNING(f'{action}: {mismatched}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Итоги всех забегов совпадают с точками'))
+
+    @staticmethod
+    def same(field, stored, actual):
+        if field == 'track_distance':
+            return abs(stored - actual) <= DISTANCE_TOLERANCE_KM
+        if field == 'speed_sum':
+            return abs(stored - actual) <= SPEED_TOLERANCE
+        return stored == actual
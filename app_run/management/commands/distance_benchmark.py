@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from app_run.distance import FORMULAS
+
+
+class Command(BaseCommand):
+    # сравнивает формулы app_run.distance с geopy.geodesic по скорости и точности
+    # на двух наборах: короткие шаги GPS-трека и длинные отрезки по всему земному шару
+    help = 'Бенчмарк и отчёт о точности формул расстояния относительно geodesic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=20000, help='количество пар точек в наборе')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count = options['pairs']
+
+        lat1 = rng.uniform(-80, 80, count)
+        lon1 = rng.uniform(-180, 180, count)
+        datasets = {
+            # соседние точки трека: до ~30 м между фиксациями
+            'gps_steps': (lat1, lon1, lat1 + rng.uniform(-3e-4, 3e-4, count), lon1 + rng.uniform(-3e-4, 3e-4, count)),
+            'long_lines': (lat1, lon1, rng.uniform(-80, 80, count), rng.uniform(-180, 180, count)),
+        }
+
+        for dataset, (a_lat, a_lon, b_lat, b_lon) in datasets.items():
+            started = time.perf_counter()
+            reference = np.array([geodesic((a_lat[i], a_lon[i]), (b_lat[i], b_lon[i])).meters for i in range(count)])
+            geodesic_time = time.perf_counter() - started
+            self.stdout.write(f'{dataset}: {count} пар, geodesic {geodesic_time * 1000:.1f} мс')
+
+            for name, formula in FORMULAS.items():
+                started = time.perf_counter()
+                result = formula(a_lat, a_lon, b_lat, b_lon)
+                elapsed = time.perf_counter() - started
+                error = np.abs(result - reference)
+                relative = error / np.maximum(reference, 1e-9)
+                self.stdout.write(
+                    f'  {name:<10} {elapsed * 1000:8.2f} мс (x{geodesic_time / max(elapsed, 1e-9):,.0f}) '
+                    f'ошибка: средняя {error.mean():.3f} м, макс {error.max():.3f} м, '
+                    f'макс относительная {relative.max() * 100:.4f}%'
+                )
@@ -0,0 +1,114 @@
+import random
+from math import cos, sin, radians
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app_run.caching import bump_version
+from app_run.distance import track_steps
+from app_run.models import Run, Position, CollectibleItem, RunFinalizeJob
+from app_run.spatial import grid_cell
+from app_run.totals import apply_run_totals, rebuild_athlete_stats
+from app_run.tracks import save_run_track
+
+BATCH_SIZE = 5000
+FIX_INTERVAL_SECONDS = 5
+METERS_PER_DEGREE = 111_320
+CENTER = (55.75, 37.62)  # точки стартов разбросаны вокруг этого центра
+
+
+class Command(BaseCommand):
+    # генерирует правдоподобные данные заданного масштаба для бенчмарков (benchmark_endpoints)
+    help = 'Генерирует атлетов, забеги, GPS-точки и предметы для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=50, help='N атлетов')
+        parser.add_argument('--runs', type=int, default=10, help='M забегов на атлета')
+        parser.add_argument('--positions', type=int, default=300, help='K GPS-точек на забег')
+        parser.add_argument('--collectibles', type=int, default=500, help='C предметов')
+        parser.add_argument('--coaches', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'gen{options["seed"]}_{timezone.now():%Y%m%d%H%M%S}'
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(username=f'{prefix}_coach{i}', first_name=f'Тренер{i}', last_name='Тестовый', is_staff=True)
+                for i in range(options['coaches'])
+            ])
+            athletes = User.objects.bulk_create([
+                User(username=f'{prefix}_athlete{i}', first_name=f'Атлет{i}',
+                     last_name=rng.choice(['Иванов', 'Петров']))
+                for i in range(options['athletes'])
+            ])
+            self.create_runs(rng, athletes, options['runs'], options['positions'])
+            self.create_collectibles(rng, prefix, options['collectibles'])
+            rebuild_athlete_stats()
+            bump_version(User, Run, Position, CollectibleItem)  # bulk-операции не шлют сигналы
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: атлетов {len(athletes)}, забегов {len(athletes) * options["runs"]}, '
+            f'точек {len(athletes) * options["runs"] * options["positions"]}, предметов {options["collectibles"]}'
+        ))
+
+    def create_runs(self, rng, athletes, runs_per_athlete, positions_per_run):
+        # последний забег каждого атлета остаётся in_progress, остальные законченные
+        runs = Run.objects.bulk_create([
+            Run(athlete=athlete, comment=f'Забег {i}',
+                status=Run.IN_PROGRESS if i == runs_per_athlete - 1 else Run.FINISHED)
+            for athlete in athletes for i in range(runs_per_athlete)
+        ])
+        started = timezone.now() - timedelta(days=len(runs))
+        pending = []
+        for index, run in enumerate(runs):
+            positions = self.random_track(rng, run, started + timedelta(hours=index), positions_per_run)
+            run.track_distance = track_steps(None, positions)
+            run.first_position_at = positions[0].date_time if positions else None
+            run.last_position_at = positions[-1].date_time if positions else None
+            run.speed_sum = sum(position.speed for position in positions)
+            run.speed_count = len(positions)
+            if run.status == Run.FINISHED:
+                apply_run_totals(run)
+                run.finalize_status = RunFinalizeJob.DONE
+            pending.extend(positions)
+            if len(pending) >= BATCH_SIZE:
+                Position.objects.bulk_create(pending, batch_size=BATCH_SIZE)
+                pending = []
+        Position.objects.bulk_create(pending, batch_size=BATCH_SIZE)
+        Run.objects.bulk_update(runs, [
+            'track_distance', 'first_position_at', 'last_position_at', 'speed_sum', 'speed_count',
+            'distance', 'run_time_seconds', 'speed', 'finalize_status',
+        ], batch_size=1000)
+        for run in runs:
+            if run.status == Run.FINISHED:
+                save_run_track(run.id)
+
+    def random_track(self, rng, run, start_time, count):
+        # случайное блуждание со скоростью бега 2.5-4 м/с и фиксацией раз в 5 секунд
+        latitude = CENTER[0] + rng.uniform(-0.2, 0.2)
+        longitude = CENTER[1] + rng.uniform(-0.3, 0.3)
+        heading = rng.uniform(0, 360)
+        positions = []
+        for i in range(count):
+            positions.append(Position(run=run, latitude=latitude, longitude=longitude,
+                                      date_time=start_time + timedelta(seconds=i * FIX_INTERVAL_SECONDS)))
+            heading += rng.gauss(0, 15)
+            step_m = rng.uniform(2.5, 4.0) * FIX_INTERVAL_SECONDS
+            latitude += step_m * cos(radians(heading)) / METERS_PER_DEGREE
+            longitude += step_m * sin(radians(heading)) / (METERS_PER_DEGREE * cos(radians(latitude)))
+        return positions
+
+    def create_collectibles(self, rng, prefix, count):
+        items = []
+        for i in range(count):
+            latitude = CENTER[0] + rng.uniform(-0.3, 0.3)
+            longitude = CENTER[1] + rng.uniform(-0.4, 0.4)
+            items.append(CollectibleItem(
+                name=f'Предмет {i}', uid=f'{prefix}_{i}', value=rng.randint(1, 100),
+                latitude=latitude, longitude=longitude, picture=f'https://example.com/items/{i}.png',
+                cell=grid_cell(latitude, longitude),  # bulk_create не вызывает save()
+            ))
+        CollectibleItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
@@ -0,0 +1,46 @@
+import json
+import os
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.gpx import import_gpx, iter_sources
+
+
+def sources_from_paths(paths):
+    # файлы gpx и zip, каталоги обходятся рекурсивно
+    for path in map(Path, paths):
+        files = sorted(p for p in path.rglob('*') if p.suffix.lower() in ('.gpx', '.zip')) if path.is_dir() else [path]
+        for file_path in files:
+            with open(file_path, 'rb') as file:
+                yield from iter_sources([file])
+
+
+class Command(BaseCommand):
+    # разбор и расчёт треков идут в пуле процессов, запись в базу - в основном процессе
+    help = 'Импорт истории забегов атлета из GPX-файлов, zip-архивов или каталогов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='gpx, zip или каталоги с ними')
+        parser.add_argument('--athlete', required=True, help='id или username атлета')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='процессов для разбора файлов')
+
+    def handle(self, *args, **options):
+        athlete = options['athlete']
+        lookup = {'pk': int(athlete)} if athlete.isdigit() else {'username': athlete}
+        user = User.objects.filter(**lookup).first()
+        if user is None:
+            raise CommandError(f'Атлет {athlete} не найден')
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f'Нет такого файла: {path}')
+
+        try:
+            report = import_gpx(user.id, sources_from_paths(options['paths']), processes=options['processes'])
+        except ValueError as error:  # архив больше пределов GPX_MAX_FILES/GPX_MAX_FILE_BYTES
+            raise CommandError(str(error))
+        self.stdout.write(f'Забегов: {len(report["runs"])}, точек: {report["points"]}, '
+                          f'файлов с ошибками: {len(report["errors"])}')
+        for error in report['errors']:
+            self.stderr.write(json.dumps(error, ensure_ascii=False))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app_run.totals import rebuild_athlete_stats
+
+
+class Command(BaseCommand):
+    # пересчитывает AthleteStats по законченным забегам, например после ручной правки забегов
+    help = 'Пересчитывает итоги атлетов (AthleteStats) по законченным забегам'
+
+    def handle(self, *args, **options):
+        count = rebuild_athlete_stats()
+        self.stdout.write(self.style.SUCCESS(f'Итоги пересчитаны для атлетов: {count}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_run.heatmap import rebuild_heatmap
+
+
+class Command(BaseCommand):
+    # пересобирает HeatmapCell по трекам всех обработанных забегов одной транзакцией,
+    # например после удаления забегов или смены HEATMAP_MAX_ZOOM / HEATMAP_CELLS;
+    # запускать при остановленном run_finalize_worker, иначе забег, обработанный во время сборки, может выпасть
+    help = 'Пересобирает тепловую карту (HeatmapCell) по всем законченным забегам'
+
+    def handle(self, *args, **options):
+        count = rebuild_heatmap()
+        self.stdout.write(self.style.SUCCESS(f'Тепловая карта пересобрана по забегам: {count}'))
@@ -0,0 +1,43 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app_run.finalize import work
+
+
+class Command(BaseCommand):
+    # разбирает очередь постобработки забегов (RunFinalizeJob) пулом процессов
+    help = 'Воркер постобработки законченных забегов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help='количество процессов воркера')
+        parser.add_argument('--max-attempts', type=int, default=5, help='попыток до статуса failed')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='пауза при пустой очереди, сек')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='через сколько секунд задача в processing считается брошенной')
+        parser.add_argument('--once', action='store_true', help='разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'max_attempts': options['max_attempts'],
+            'poll_interval': options['poll_interval'],
+            'stale_after': options['stale_after'],
+            'once': options['once'],
+        }
+        if options['processes'] <= 1:
+            work(**kwargs)
+            return
+
+        # соединение с базой нельзя делить между процессами, каждый откроет своё
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=work, kwargs=kwargs) for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
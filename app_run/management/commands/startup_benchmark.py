@@ -0,0 +1,95 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Код, который выполняется в свежем интерпретаторе: загрузка WSGI-приложения и первый запрос,
+# как при холодном старте на Lambda. Время импорта каждого модуля печатает сам python -X importtime.
+COLD_START_SCRIPT = '''
+import io, json, sys, time
+started = time.perf_counter()
+from project_run.wsgi import application
+loaded = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {"PATH_INFO": sys.argv[1], "REQUEST_METHOD": "GET", "wsgi.input": io.BytesIO()}
+setup_testing_defaults(environ)
+statuses = []
+b"".join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.perf_counter()
+print(json.dumps({"app_loaded": loaded - started, "first_response": done - started, "status": statuses[0]}))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+class Command(BaseCommand):
+    # запускает холодный старт несколько раз в отдельных процессах с текущими настройками
+    # (например --settings project_run.settings.api) и печатает JSON: время загрузки приложения,
+    # время до первого ответа и самые долгие импорты модулей и пакетов (медианы по запускам)
+    help = 'Бенчмарк холодного старта: время импорта по модулям и время до первого ответа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='количество холодных стартов')
+        parser.add_argument('--path', default='/api/company_details/', help='url первого запроса')
+        parser.add_argument('--top', type=int, default=20, help='сколько самых долгих импортов показать')
+        parser.add_argument('--output', help='файл для JSON-отчёта, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        timings, modules, packages = [], {}, {}
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', COLD_START_SCRIPT, options['path']],
+                capture_output=True, text=True, env=env, cwd=settings.BASE_DIR,
+            )
+            if result.returncode != 0:
+                raise CommandError(result.stderr.strip().splitlines()[-1])
+            timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+            run_packages = {}
+            for line in result.stderr.splitlines():
+                match = IMPORT_LINE.match(line)
+                if match is None:
+                    continue
+                self_us, cumulative_us, _, name = match.groups()
+                modules.setdefault(name, []).append((int(self_us), int(cumulative_us)))
+                package = name.split('.')[0]
+                run_packages[package] = run_packages.get(package, 0) + int(self_us)
+            for package, self_us in run_packages.items():
+                packages.setdefault(package, []).append(self_us)
+
+        def median_ms(values):
+            return round(float(np.median(values)) / 1000, 2)
+
+        top_modules = sorted(
+            ({'module': name,
+              'self_ms': median_ms([self_us for self_us, _ in values]),
+              'cumulative_ms': median_ms([cumulative for _, cumulative in values])}
+             for name, values in modules.items()),
+            key=lambda row: row['cumulative_ms'], reverse=True,
+        )
+        top_packages = sorted(
+            ({'package': name, 'self_ms': median_ms(values)} for name, values in packages.items()),
+            key=lambda row: row['self_ms'], reverse=True,
+        )
+
+        result = json.dumps({
+            'settings': settings.SETTINGS_MODULE,
+            'runs': options['runs'],
+            'path': options['path'],
+            'status': sorted({timing['status'] for timing in timings}),
+            'app_loaded_ms': round(float(np.median([t['app_loaded'] for t in timings])) * 1000, 1),
+            'first_response_ms': round(float(np.median([t['first_response'] for t in timings])) * 1000, 1),
+            'modules': top_modules[:options['top']],
+            'packages': top_packages[:options['top']],
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(result)
+        else:
+            self.stdout.write(result)
@@ -0,0 +1,246 @@
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+
+# Метрики запросов: RequestMetricsMiddleware считает для каждого маршрута запросы к базе,
+# время SQL, время сериализаторов (.data у TimedSerializerMixin), время рендеринга ответа DRF
+# (TimedJSONRenderer в REST_FRAMEWORK) и размер ответа, отдаёт их в заголовке Server-Timing и копит
+# гистограммы, которые /metrics отдаёт в текстовом формате Prometheus.
+# Гистограммы живут в памяти процесса: при нескольких воркерах у каждого свои.
+# Там же холодный старт процесса: wsgi.py/asgi.py отмечают начало загрузки,
+# /metrics отдаёт время до готового приложения и до первого отданного ответа.
+
+logger = logging.getLogger('app_run.metrics')
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 500]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+
+def label_value(value):
+    # в тексте Prometheus значение метки экранируется: маршруты DRF с суффиксом формата содержат '\.'
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # метки -> [счётчики корзин, сумма, количество]
+
+    def observe(self, labels, value):
+        counts = self.series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[0][index] += 1
+        counts[1] += value
+        counts[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for (route, method), (buckets, total, count) in sorted(self.series.items()):
+            labels = f'route="{label_value(route)}",method="{label_value(method)}"'
+            for bound, value in zip(self.buckets, buckets):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {value}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+HISTOGRAMS = {
+    'duration': Histogram('http_request_duration_seconds', 'Время обработки запроса', DURATION_BUCKETS),
+    'sql': Histogram('http_request_db_seconds', 'Суммарное время SQL за запрос', DURATION_BUCKETS),
+    'queries': Histogram('http_request_db_queries', 'Количество SQL-запросов за запрос', QUERY_BUCKETS),
+    'serializer': Histogram('http_request_serializer_seconds', 'Время сериализаторов DRF за запрос',
+                            DURATION_BUCKETS),
+    'render': Histogram('http_request_render_seconds', 'Время рендеринга ответов DRF за запрос', DURATION_BUCKETS),
+    'size': Histogram('http_response_size_bytes', 'Размер тела ответа', SIZE_BUCKETS),
+}
+COLD_START = {}  # этап -> секунды от начала загрузки процесса: app_loaded, first_response
+_process_started = None
+_lock = threading.Lock()
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def mark_process_started(started):
+    # started - time.perf_counter() в самом начале wsgi.py/asgi.py, вызывается после загрузки приложения
+    global _process_started
+    _process_started = started
+    COLD_START['app_loaded'] = time.perf_counter() - started
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []  # (секунды, sql)
+        self.serializer = 0.0
+        self.serializer_depth = 0
+        self.render = 0.0
+
+    @property
+    def sql_time(self):
+        return sum(duration for duration, _ in self.queries)
+
+
+def _record_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.queries.append((time.perf_counter() - started, sql))
+
+
+def _install_query_timer(connection, **kwargs):
+    # соединения живут в своих потоках (под ASGI запросы к базе идут из пула sync_to_async),
+    # поэтому обёртка ставится на каждое соединение при создании, а запрос находится через contextvar
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_timer)
+
+
+def _timed_data(read):
+    # время считается только у внешнего сериализатора, вложенные уже входят в него
+    stats = _current.get()
+    if stats is None or stats.serializer_depth:
+        return read()
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        return read()
+    finally:
+        stats.serializer_depth -= 1
+        stats.serializer += time.perf_counter() - started
+
+
+class TimedListSerializer(ListSerializer):
+    @property
+    def data(self):
+        return _timed_data(lambda: super(TimedListSerializer, self).data)
+
+
+class TimedSerializerMixin:
+    # сериализатор с замером времени .data; для many=True Meta наследника получает TimedListSerializer,
+    # если свой list_serializer_class не задан
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = cls.__dict__.get('Meta')
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        return _timed_data(lambda: super(TimedSerializerMixin, self).data)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    # JSONRenderer с замером времени: рендеринг идёт после view, когда middleware ещё ждёт ответ
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.render += time.perf_counter() - started
+
+
+class RequestMetricsMiddleware:
+    # работает и в WSGI, и в ASGI: асинхронные view не переводятся из-за неё в поток
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            _install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+
+        size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{len(stats.queries)} queries"',
+            f'serializer;dur={stats.serializer * 1000:.1f}',
+            f'render;dur={stats.render * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ])
+
+        match = request.resolver_match
+        labels = (match.route if match else 'unresolved', request.method)
+        with _lock:
+            HISTOGRAMS['duration'].observe(labels, duration)
+            HISTOGRAMS['sql'].observe(labels, stats.sql_time)
+            HISTOGRAMS['queries'].observe(labels, len(stats.queries))
+            HISTOGRAMS['serializer'].observe(labels, stats.serializer)
+            HISTOGRAMS['render'].observe(labels, stats.render)
+            if size is not None:
+                HISTOGRAMS['size'].observe(labels, size)
+            if _process_started is not None and 'first_response' not in COLD_START:
+                COLD_START['first_response'] = time.perf_counter() - _process_started
+
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+        if threshold is not None and duration * 1000 >= threshold:
+            self.log_slow_request(request, duration, stats)
+        return response
+
+    def log_slow_request(self, request, duration, stats):
+        top = sorted(stats.queries, key=lambda query: query[0], reverse=True)
+        top = top[:getattr(settings, 'SLOW_REQUEST_TOP_SQL', 5)]
+        statements = '\n'.join(f'  {seconds * 1000:.1f} ms: {sql}' for seconds, sql in top)
+        logger.warning(
+            'Медленный запрос %s %s: %.1f ms, SQL %d запросов за %.1f ms, '
+            'сериализаторы %.1f ms, рендеринг %.1f ms\n%s',
+            request.method, request.get_full_path(), duration * 1000, len(stats.queries),
+            stats.sql_time * 1000, stats.serializer * 1000, stats.render * 1000, statements,
+        )
+
+
+def metrics(request):
+    with _lock:
+        lines = [line for histogram in HISTOGRAMS.values() for line in histogram.render()]
+        if COLD_START:
+            lines += ['# HELP process_cold_start_seconds Холодный старт процесса по этапам',
+                      '# TYPE process_cold_start_seconds gauge']
+            lines += [f'process_cold_start_seconds{{stage="{stage}"}} {seconds}'
+                      for stage, seconds in COLD_START.items()]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
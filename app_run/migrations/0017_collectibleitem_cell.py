@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 19:26
+
+from math import floor
+
+from django.db import migrations, models
+
+# копия app_run.spatial.grid_cell на момент миграции: модуль может измениться, а миграция - нет
+CELL_SIZE = 0.01
+LON_CELLS = round(360 / CELL_SIZE)
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return ""
+    if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        return ""
+    lon_index = (floor(longitude / CELL_SIZE) + LON_CELLS // 2) % LON_CELLS - LON_CELLS // 2
+    return f"{floor(latitude / CELL_SIZE)}:{lon_index}"
+
+
+def fill_cells(apps, schema_editor):
+    CollectibleItem = apps.get_model("app_run", "CollectibleItem")
+    items = list(CollectibleItem.objects.only("id", "latitude", "longitude"))
+    for item in items:
+        item.cell = grid_cell(item.latitude, item.longitude)
+    CollectibleItem.objects.bulk_update(items, ["cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0016_position_distance_position_speed_run_speed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="collectibleitem",
+            name="cell",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=32),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2 on 2026-10-18 19:27
+
+from math import asin, atan, cos, radians, sin, sqrt, tan
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+# формула Ламберта для эллипсоида WGS-84, как при приёме точек (app_run.distance.lambert_m),
+# скалярная копия на момент миграции
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+def lambert_m(lat1, lon1, lat2, lon2):
+    beta1 = atan((1 - WGS84_F) * tan(radians(lat1)))
+    beta2 = atan((1 - WGS84_F) * tan(radians(lat2)))
+    h = sin((beta2 - beta1) / 2) ** 2 + cos(beta1) * cos(beta2) * sin(radians(lon2 - lon1) / 2) ** 2
+    sigma = 2 * asin(sqrt(min(max(h, 0.0), 1.0)))
+    if sigma == 0:
+        return 0.0
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_half, cos_half = sin(sigma / 2), cos(sigma / 2)
+    x = (sigma - sin(sigma)) * sin(p) ** 2 * cos(q) ** 2 / (cos_half ** 2 if cos_half else 1.0)
+    y = (sigma + sin(sigma)) * cos(p) ** 2 * sin(q) ** 2 / sin_half ** 2
+    return WGS84_A * (sigma - WGS84_F / 2 * (x + y))
+
+
+def fill_totals(apps, schema_editor):
+    # итоги нужны только незаконченным забегам, законченные уже посчитаны при stop
+    Run = apps.get_model("app_run", "Run")
+    Position = apps.get_model("app_run", "Position")
+    for run in Run.objects.exclude(status="finished"):
+        positions = Position.objects.filter(run_id=run.id).order_by("id")
+        points = list(positions.values_list("latitude", "longitude"))
+        result = positions.aggregate(
+            first_position_at=Min("date_time"),
+            last_position_at=Max("date_time"),
+            speed_sum=Sum("speed"),
+            speed_count=Count("speed"),
+        )
+        run.first_position_at = result["first_position_at"]
+        run.last_position_at = result["last_position_at"]
+        run.speed_sum = result["speed_sum"] or 0.0
+        run.speed_count = result["speed_count"]
+        run.track_distance = sum(lambert_m(*start, *end) for start, end in zip(points, points[1:])) / 1000
+        run.save()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0017_collectibleitem_cell"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="run",
+            name="first_position_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="last_position_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="speed_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="speed_sum",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="run",
+            name="track_distance",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
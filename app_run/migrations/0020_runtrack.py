@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0019_run_finalize_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RunTrack",
+            fields=[
+                (
+                    "run",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="track",
+                        serialize=False,
+                        to="app_run.run",
+                    ),
+                ),
+                ("points", models.IntegerField(default=0)),
+                ("data", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-18 19:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def fill_stats(apps, schema_editor):
+    Run = apps.get_model("app_run", "Run")
+    AthleteStats = apps.get_model("app_run", "AthleteStats")
+    rows = (
+        Run.objects.filter(status="finished")
+        .values("athlete_id")
+        .annotate(
+            runs_finished=Count("id"),
+            total_distance=Sum("distance"),
+            total_time_seconds=Sum("run_time_seconds"),
+            last_run_id=Max("id"),
+        )
+    )
+    AthleteStats.objects.bulk_create(
+        [
+            AthleteStats(
+                user_id=row["athlete_id"],
+                runs_finished=row["runs_finished"],
+                total_distance=row["total_distance"] or 0.0,
+                total_time_seconds=row["total_time_seconds"] or 0,
+                last_run_id=row["last_run_id"],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0020_runtrack"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AthleteStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="athlete_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("runs_finished", models.IntegerField(default=0)),
+                ("total_distance", models.FloatField(default=0.0)),
+                ("total_time_seconds", models.IntegerField(default=0)),
+                (
+                    "last_run",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="app_run.run",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 19:34
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # до появления ограничения параллельные stop могли выдать челлендж дважды
+    Challenge = apps.get_model("app_run", "Challenge")
+    keep = Challenge.objects.values("athlete_id", "full_name").annotate(first_id=Min("id"))
+    Challenge.objects.exclude(id__in=[row["first_id"] for row in keep]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0021_athletestats"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="challenge",
+            constraint=models.UniqueConstraint(
+                fields=("athlete", "full_name"), name="unique_athlete_challenge"
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+# поиск атлетов (SearchFilter, icontains) - LIKE '%...%' по UPPER(имени), обычный B-tree тут
+# не поможет, в PostgreSQL для этого триграммный GIN-индекс; SQLite такой индекс не умеет
+NAME_INDEXES = {
+    "app_run_user_first_name_trgm": "first_name",
+    "app_run_user_last_name_trgm": "last_name",
+}
+
+
+def create_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in NAME_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON auth_user USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+        )
+
+
+def drop_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in NAME_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app_run", "0022_challenge_unique"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="position",
+            index=models.Index(
+                fields=["run", "id"], name="app_run_pos_run_id_f75559_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="position",
+            index=models.Index(
+                fields=["run", "date_time", "id"], name="app_run_pos_run_id_a1bde1_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="run",
+            index=models.Index(
+                fields=["athlete", "status"], name="app_run_run_athlete_42b457_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="run",
+            index=models.Index(
+                fields=["created_at", "id"], name="app_run_run_created_dedccc_idx"
+            ),
+        ),
+        migrations.RunPython(create_name_indexes, drop_name_indexes),
+    ]
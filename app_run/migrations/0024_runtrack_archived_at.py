@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0023_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="runtrack",
+            name="archived_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
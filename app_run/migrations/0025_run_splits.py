@@ -0,0 +1,35 @@
+# Generated by Django 5.2 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0024_runtrack_archived_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RunSplits",
+            fields=[
+                (
+                    "run",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="splits",
+                        serialize=False,
+                        to="app_run.run",
+                    ),
+                ),
+                ("elapsed_time_seconds", models.IntegerField(default=0)),
+                ("moving_time_seconds", models.IntegerField(default=0)),
+                ("moving_distance_m", models.FloatField(default=0.0)),
+                ("splits", models.JSONField(default=list)),
+                ("zone_edges", models.JSONField(default=list)),
+                ("pace_zones", models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.core.management import call_command
+from django.db import migrations
+
+# таблица DatabaseCache (CACHES в project_run.settings.production) создаётся вместе со схемой,
+# без отдельного manage.py createcachetable при деплое; с файловым кэшем команда ничего не делает
+
+
+def create_cache_table(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_run", "0026_heatmap_cell"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
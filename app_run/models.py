@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from app_run.spatial import grid_cell
 
 
 class Run(models.Model):
@@ -20,11 +23,93 @@ class Run(models.Model):
     distance = models.FloatField(default=0.0, blank=True, null=True)
     run_time_seconds = models.IntegerField(default=0)
     speed = models.FloatField(blank=True, null=True)
+    # накопительные итоги по точкам забега, обновляются при записи каждой Position (app_run.totals)
+    track_distance = models.FloatField(default=0.0)
+    first_position_at = models.DateTimeField(blank=True, null=True)
+    last_position_at = models.DateTimeField(blank=True, null=True)
+    speed_sum = models.FloatField(default=0.0)
+    speed_count = models.IntegerField(default=0)
+    # состояние постобработки после stop, её выполняет воркер run_finalize_worker (app_run.finalize)
+    finalize_status = models.CharField(max_length=16, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['athlete', 'status']),  # забеги атлета по статусу
+            models.Index(fields=['created_at', 'id']),  # keyset-пагинация /api/runs/
+        ]
 
     def __str__(self):
         return f'{self.athlete}'
 
 
+class RunFinalizeJob(models.Model):
+    # очередь постобработки законченных забегов в базе, без внешнего брокера
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS = [
+        (PENDING, 'pending'),
+        (PROCESSING, 'processing'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    ]
+
+    run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name='finalize_jobs')
+    status = models.CharField(max_length=16, choices=STATUS, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # раньше этого времени задачу не берём (повтор с паузой)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+
+class RunTrack(models.Model):
+    # сжатый трек законченного забега одной строкой, формат в app_run.tracks
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, primary_key=True, related_name='track')
+    points = models.IntegerField(default=0)
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    archived_at = models.DateTimeField(blank=True, null=True)  # строки Position забега удалены (app_run.archive)
+
+
+class RunSplits(models.Model):
+    # аналитика законченного забега: отрезки по километру, время в движении, зоны темпа (app_run.splits)
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, primary_key=True, related_name='splits')
+    elapsed_time_seconds = models.IntegerField(default=0)
+    moving_time_seconds = models.IntegerField(default=0)
+    moving_distance_m = models.FloatField(default=0.0)
+    splits = models.JSONField(default=list)  # [[дистанция м, секунд], ...]
+    zone_edges = models.JSONField(default=list)  # границы зон темпа, сек/км
+    pace_zones = models.JSONField(default=list)  # секунд в каждой зоне, на одну больше, чем границ
+
+
+class HeatmapCell(models.Model):
+    # ячейка тепловой карты на одном zoom: сколько забегов и точек в неё попало (app_run.heatmap)
+    zoom = models.SmallIntegerField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    runs = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        # уникальность для UPSERT и индекс для выборки ячеек тайла
+        constraints = [models.UniqueConstraint(fields=['zoom', 'x', 'y'], name='unique_heatmap_cell')]
+
+
+class AthleteStats(models.Model):
+    # итоги атлета по законченным забегам, обновляются в постобработке забега (app_run.totals)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='athlete_stats')
+    runs_finished = models.IntegerField(default=0)
+    total_distance = models.FloatField(default=0.0)
+    total_time_seconds = models.IntegerField(default=0)
+    last_run = models.ForeignKey(Run, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+
+
 class AthleteInfo(models.Model):
     user_id = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='athlete_info')
     goals = models.TextField(default=None)
@@ -35,6 +120,10 @@ class Challenge(models.Model):
     full_name = models.CharField()
     athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='challenge')
 
+    class Meta:
+        # челлендж выдаётся атлету один раз, даже если забеги остановлены одновременно
+        constraints = [models.UniqueConstraint(fields=['athlete', 'full_name'], name='unique_athlete_challenge')]
+
 
 class Position(models.Model):
     run = models.ForeignKey(Run, on_delete=models.CASCADE)
@@ -44,6 +133,12 @@ class Position(models.Model):
     speed = models.FloatField(blank=True, null=True)
     distance = models.FloatField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'id']),  # последняя точка забега при записи новой
+            models.Index(fields=['run', 'date_time', 'id']),  # трек забега по времени, keyset-пагинация
+        ]
+
 
 class CollectibleItem(models.Model):
     name = models.CharField()
@@ -53,3 +148,8 @@ class CollectibleItem(models.Model):
     picture = models.CharField()
     value = models.IntegerField()
     users = models.ManyToManyField(User, related_name='collectible_items')
+    cell = models.CharField(max_length=32, blank=True, default='', db_index=True)  # ячейка сетки app_run.spatial
+
+    def save(self, *args, **kwargs):
+        self.cell = grid_cell(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
@@ -1,16 +1,19 @@
 from rest_framework import serializers
-from .models import Run, AthleteInfo, Challenge, Position, CollectibleItem
+from .models import Run, AthleteInfo, Challenge, Position, CollectibleItem, AthleteStats
 from django.contrib.auth.models import User
 
+from .ingest import get_session, session_run
+from .metrics import TimedSerializerMixin
 
-class UserForRunSerializer(serializers.ModelSerializer):
+
+class UserForRunSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Этот сериалайзер будем вкладывать в RunSerializer
     class Meta:
         model = User
         fields = ['id', 'username', 'last_name', 'first_name']
 
 
-class RunSerializer(serializers.ModelSerializer):
+class RunSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     athlete_data = UserForRunSerializer(source='athlete',
                                         read_only=True)  # Добавляем UserForRunSerializer как вложенный
 
@@ -18,9 +21,11 @@ class RunSerializer(serializers.ModelSerializer):
     class Meta:
         model = Run
         fields = '__all__'
+        read_only_fields = ['track_distance', 'first_position_at', 'last_position_at', 'speed_sum', 'speed_count',
+                            'finalize_status']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     type = serializers.SerializerMethodField()  # позволяет динамически вычислять значение для этого поля
     runs_finished = serializers.SerializerMethodField()
 
@@ -34,10 +39,11 @@ class UserSerializer(serializers.ModelSerializer):
         return 'athlete'
 
     def get_runs_finished(self, instance):
+        # счётчик ведётся в AthleteStats, у атлета без законченных забегов записи может не быть
         try:
-            return instance.runs_finished
-        except:
-            return instance.runs.filter(status='finished').count()
+            return instance.athlete_stats.runs_finished
+        except AthleteStats.DoesNotExist:
+            return 0
 
 
 class UserDetailSerializer(UserSerializer):  # дополнительный сериалайзер для GetUsers
@@ -61,25 +67,37 @@ class UserDetailSerializer(UserSerializer):  # дополнительный се
         ]
 
 
-class RunStatus(serializers.ModelSerializer):
+class RunStatus(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Run
         fields = ['id', 'athlete', 'status']
 
 
-class AthleteInfoSerializer(serializers.ModelSerializer):
+class AthleteInfoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = AthleteInfo
         fields = ['user_id', 'goals', 'weight']
 
 
-class ChallengeSerializer(serializers.ModelSerializer):
+class ChallengeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Challenge
         fields = ['full_name', 'athlete']
 
 
-class PositionSerializer(serializers.ModelSerializer):
+class IngestRunField(serializers.PrimaryKeyRelatedField):
+    # забег берётся из состояния приёма точек в кэше (app_run.ingest), а не запросом в базу
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not str(data).isdigit():
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        state = get_session(int(data))
+        if state is None:
+            self.fail('does_not_exist', pk_value=data)
+        return session_run(int(data), state)
+
+
+class PositionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    run = IngestRunField(queryset=Run.objects.all())
     date_time = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%S.%f')
 
     class Meta:
@@ -87,8 +105,8 @@ class PositionSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def validate_run(self, value):
-        run_status = Run.objects.get(id=value.id).status
-        if run_status != 'in_progress':
+        # value - заготовка Run из IngestRunField со статусом из кэша, запроса в базу нет
+        if value.status != 'in_progress':
             raise serializers.ValidationError("Статус забега должен быть 'in progress'")
         return value
 
@@ -103,7 +121,13 @@ class PositionSerializer(serializers.ModelSerializer):
         return value
 
 
-class CollectibleSerializer(serializers.ModelSerializer):
+class PositionBatchItemSerializer(PositionSerializer):
+    # точка из пакетной загрузки: забег проверяется один раз на весь пакет во view
+    class Meta(PositionSerializer.Meta):
+        fields = ['latitude', 'longitude', 'date_time']
+
+
+class CollectibleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     picture = serializers.URLField()
 
     class Meta:
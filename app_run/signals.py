@@ -0,0 +1,72 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from app_run.caching import bump_version, COLLECTIBLE_CELLS, RUN_TRACK
+from app_run.ingest import forget_session
+from app_run.models import Run, Position, CollectibleItem, Challenge, AthleteStats
+from app_run.totals import is_counted, refresh_athlete_stats
+
+# любое изменение модели делает устаревшими закэшированные ответы, которые от неё зависят.
+# Приёмники подключаются только к своим моделям: приёмник post_delete выключает у модели быстрое удаление
+# одним DELETE, и Django стал бы загружать каждую удаляемую строку и слать сигнал на неё.
+# Поэтому у Position приёмника post_delete нет: точки удаляют PositionViewSet.perform_destroy,
+# архивация (app_run.archive) и каскад от Run - и один раз сбрасывают версию и состояние приёма сами
+
+VERSIONED_MODELS = [Run, Position, CollectibleItem, Challenge, AthleteStats, User]
+
+
+def bump_model_version(sender, **kwargs):
+    bump_version(sender)
+    if sender is CollectibleItem:
+        bump_version(COLLECTIBLE_CELLS)  # предметы по ячейкам (app_run.ingest.cell_items)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_model_version, sender=model, dispatch_uid=f'bump-version-save-{model._meta.label}')
+    if model is not Position:
+        post_delete.connect(bump_model_version, sender=model, dispatch_uid=f'bump-version-delete-{model._meta.label}')
+
+
+@receiver(m2m_changed, sender=CollectibleItem.users.through)
+def bump_collectible_users_version(sender, **kwargs):
+    bump_version(CollectibleItem)
+
+
+@receiver(post_save, sender=Run)
+@receiver(post_delete, sender=Run)
+def forget_run_ingest_session(sender, instance, **kwargs):
+    # статус или атлет забега могли измениться, состояние приёма точек перечитается из базы;
+    # после коммита, иначе параллельный POST успеет перечитать и закэшировать старый статус
+    run_id = instance.pk
+    transaction.on_commit(lambda: forget_session(run_id))
+
+
+@receiver(post_save, sender=Run)
+@receiver(post_delete, sender=Run)
+def bump_run_track_version(sender, instance, **kwargs):
+    # кэш упрощённых треков забега: забег удалён, перезапущен или заново обработан
+    bump_version(RUN_TRACK.format(instance.pk))
+
+
+@receiver(post_delete, sender=Run)
+def bump_run_positions_version(sender, instance, **kwargs):
+    # точки забега удалены каскадом одним DELETE, без сигналов
+    bump_version(Position)
+
+
+@receiver(post_delete, sender=Run)
+def remove_run_from_athlete_stats(sender, instance, **kwargs):
+    # удалённый забег, учтённый в итогах атлета, вычитается из них в той же транзакции
+    if is_counted(instance):
+        refresh_athlete_stats(instance.athlete_id)
+
+
+@receiver(post_save, sender=Position)
+def forget_position_ingest_session(sender, instance, created=False, **kwargs):
+    # новые точки view записывают в состояние сами, правка точки могла сменить последнюю и трек
+    if not created:
+        run_id = instance.run_id
+        transaction.on_commit(lambda: forget_session(run_id))
+        bump_version(RUN_TRACK.format(run_id))
@@ -0,0 +1,44 @@
+from math import cos, floor, radians
+
+# Сетка для поиска CollectibleItem рядом с точкой забега.
+# Предмет хранит номер своей ячейки, поэтому для точки достаточно выбрать
+# предметы из соседних ячеек и только для них считать точное расстояние.
+
+CELL_SIZE = 0.01  # размер ячейки в градусах, ~1.1 км по широте
+LON_CELLS = round(360 / CELL_SIZE)
+COLLECT_RADIUS_KM = 0.1  # радиус, в котором атлет подбирает предмет
+
+
+def _lon_index(index):
+    # долгота замыкается: ячейка у 180° соседствует с ячейкой у -180°
+    return (index + LON_CELLS // 2) % LON_CELLS - LON_CELLS // 2
+
+
+def grid_cell(latitude, longitude):
+    # для некорректных координат ячейки нет, такие предметы не будут найдены
+    if latitude is None or longitude is None:
+        return ''
+    if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        return ''
+    return f'{floor(latitude / CELL_SIZE)}:{_lon_index(floor(longitude / CELL_SIZE))}'
+
+
+def cells_around(latitude, longitude, radius_km=COLLECT_RADIUS_KM):
+    # все ячейки, которые пересекает круг радиуса radius_km вокруг точки
+    delta_lat = radius_km / 110.574
+    lat_from = max(latitude - delta_lat, -90.0)
+    lat_to = min(latitude + delta_lat, 90.0)
+    # ближе к полюсу градус долготы короче, поэтому захватываем больше ячеек
+    widest = max(abs(lat_from), abs(lat_to))
+    km_per_lon_degree = 111.320 * cos(radians(widest))
+    if km_per_lon_degree * 360 <= 2 * radius_km:
+        lon_indexes = range(-LON_CELLS // 2, LON_CELLS // 2)
+    else:
+        delta_lon = radius_km / km_per_lon_degree
+        lon_indexes = range(floor((longitude - delta_lon) / CELL_SIZE), floor((longitude + delta_lon) / CELL_SIZE) + 1)
+    lon_indexes = {_lon_index(i) for i in lon_indexes}
+    return {
+        f'{lat_index}:{lon_index}'
+        for lat_index in range(floor(lat_from / CELL_SIZE), floor(lat_to / CELL_SIZE) + 1)
+        for lon_index in lon_indexes
+    }
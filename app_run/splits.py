@@ -0,0 +1,94 @@
+import numpy as np
+from django.conf import settings
+
+from app_run.distance import path_distances_m
+from app_run.models import RunSplits
+from app_run.tracks import run_track_points
+
+# Аналитика законченного забега, считается в постобработке (app_run.finalize) одним векторным проходом
+# по треку и хранится в RunSplits, поэтому /api/runs/<id>/analytics/ точки больше не читает:
+#   splits        - отрезки по километру: [дистанция м, секунд], последний отрезок может быть короче
+#   moving_time   - время (и дистанция) на участках быстрее RUN_MOVING_SPEED м/с,
+#   elapsed_time  - от первой точки до последней
+#   pace_zones    - секунд движения в каждой зоне темпа, границы зон (сек/км) - RUN_PACE_ZONES
+# Точки без времени в расчёт не берутся.
+
+SPLIT_M = 1000
+
+
+def compute_splits(points):
+    # points - словари с latitude, longitude, date_time в порядке трека
+    points = [point for point in points if point['date_time'] is not None]
+    edges = list(settings.RUN_PACE_ZONES)
+    result = {'elapsed_time': 0, 'moving_time': 0, 'moving_distance': 0.0, 'splits': [], 'zone_edges': edges,
+              'pace_zones': [0] * (len(edges) + 1)}
+    if len(points) < 2:
+        return result
+
+    steps_m = path_distances_m([p['latitude'] for p in points], [p['longitude'] for p in points])
+    times = np.array([p['date_time'].timestamp() for p in points])
+    deltas = np.diff(times)
+    cumulative_m = np.concatenate(([0.0], np.cumsum(steps_m)))
+    elapsed = times - times[0]
+
+    # моменты прохождения каждого полного километра - интерполяция по накопленной дистанции
+    total_m = cumulative_m[-1]
+    marks_m = np.append(np.arange(SPLIT_M, total_m, SPLIT_M), total_m)
+    marks_s = np.interp(marks_m, cumulative_m, elapsed)
+    split_m = np.diff(marks_m, prepend=0.0)
+    split_s = np.diff(marks_s, prepend=0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.where(deltas > 0, steps_m / deltas, 0.0)
+        moving = speeds >= settings.RUN_MOVING_SPEED
+        paces = np.where(moving, deltas / (steps_m / 1000), np.inf)
+    zones, _ = np.histogram(paces[moving], bins=[0.0, *edges, np.inf], weights=deltas[moving])
+
+    result.update({
+        'elapsed_time': int(round(elapsed[-1])),
+        'moving_time': int(round(deltas[moving].sum())),
+        'moving_distance': round(float(steps_m[moving].sum()), 1),
+        'splits': [[round(float(m), 1), round(float(s), 1)] for m, s in zip(split_m, split_s) if m > 0],
+        'pace_zones': [int(round(seconds)) for seconds in zones],
+    })
+    return result
+
+
+def save_run_splits(run_id):
+    # считает аналитику по треку забега (RunTrack, если он уже сохранён) и записывает RunSplits
+    result = compute_splits(run_track_points(run_id))
+    splits, _ = RunSplits.objects.update_or_create(run_id=run_id, defaults={
+        'elapsed_time_seconds': result['elapsed_time'],
+        'moving_time_seconds': result['moving_time'],
+        'moving_distance_m': result['moving_distance'],
+        'splits': result['splits'],
+        'zone_edges': result['zone_edges'],
+        'pace_zones': result['pace_zones'],
+    })
+    return splits
+
+
+def splits_data(run, splits):
+    # ответ /api/runs/<id>/analytics/: темп в сек/км, зоны с границами
+    distance_km = sum(m for m, _ in splits.splits) / 1000
+    kilometres = []
+    for index, (split_m, split_s) in enumerate(splits.splits, 1):
+        kilometres.append({
+            'km': index,
+            'distance_m': split_m,
+            'seconds': split_s,
+            'pace': round(split_s / (split_m / 1000), 1) if split_m else None,
+        })
+    bounds = [None, *splits.zone_edges, None]
+    zones = [{'from': bounds[index], 'to': bounds[index + 1], 'seconds': seconds}
+             for index, seconds in enumerate(splits.pace_zones)]
+    return {
+        'run': run.id,
+        'distance_km': round(distance_km, 3),
+        'elapsed_time_seconds': splits.elapsed_time_seconds,
+        'moving_time_seconds': splits.moving_time_seconds,
+        'average_moving_pace': round(splits.moving_time_seconds / (splits.moving_distance_m / 1000), 1)
+        if splits.moving_distance_m else None,
+        'splits': kilometres,
+        'pace_zones': zones,
+    }
@@ -1,3 +1,658 @@
-from django.test import TestCase
+import atexit
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+
+from app_run import buffer
+from app_run.archive import archive_run
+from app_run.distance import path_distances_m
+from app_run.finalize import process_next_job, requeue_stale_jobs
+from app_run.heatmap import add_run_to_heatmap, rebuild_heatmap, run_cells
+from app_run.ingest import get_session
+from app_run.models import Run, Position, Challenge, CollectibleItem, RunFinalizeJob, RunTrack, HeatmapCell
+from app_run.tracks import decode_track, encode_track
+from app_run.views import PositionKeysetPagination
+
+
+class HotQueryPlanTests(TestCase):
+    # планы горячих запросов на заполненной базе: ни один не должен читать таблицу целиком
+    # в PostgreSQL seq scan запрещается на время EXPLAIN, иначе на маленькой базе он всегда дешевле,
+    # и тест проверяет, что у запроса вообще есть подходящий индекс
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athletes = [User.objects.create(username=f'athlete{i}', first_name=f'Имя{i}') for i in range(20)]
+        cls.now = timezone.now()
+        runs = Run.objects.bulk_create([
+            Run(athlete=athlete, comment='', status=status)
+            for athlete in cls.athletes for status in [Run.FINISHED, Run.FINISHED, Run.IN_PROGRESS]
+        ])
+        Position.objects.bulk_create([
+            Position(run=run, latitude=55 + i / 1e4, longitude=37.0, date_time=cls.now + timedelta(seconds=i))
+            for run in runs for i in range(50)
+        ])
+        Challenge.objects.bulk_create([
+            Challenge(athlete=athlete, full_name=f'Челлендж {i}') for athlete in cls.athletes for i in range(5)
+        ])
+        CollectibleItem.objects.bulk_create([
+            CollectibleItem(name='', uid=str(i), latitude=55.0, longitude=37.0 + i / 100, picture='', value=1,
+                            cell=f'5500:{3700 + i}')
+            for i in range(100)
+        ])
+        RunFinalizeJob.objects.bulk_create([RunFinalizeJob(run=run, status=RunFinalizeJob.DONE) for run in runs])
+        cls.track_run = runs[0]
+        cls.athlete = cls.athletes[0]
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                return queryset.explain()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return queryset.explain()
+
+    def assertNoSeqScan(self, queryset):
+        plan = self.explain(queryset)
+        if connection.vendor == 'postgresql':
+            full_scans = re.findall(r'Seq Scan on (\w+)', plan)
+        else:
+            # "SCAN table" без "USING ... INDEX" - полный проход по таблице
+            full_scans = re.findall(r'\bSCAN (\w+)\b(?! USING)', plan)
+        self.assertEqual(full_scans, [], plan)
+
+    def test_last_position_of_run(self):
+        self.assertNoSeqScan(Position.objects.filter(run=self.track_run).order_by('-id')[:1])
+
+    def test_run_track_by_time(self):
+        self.assertNoSeqScan(Position.objects.filter(run=self.track_run).order_by('date_time', 'id'))
+
+    def test_positions_keyset_page(self):
+        after = Q(date_time__gte=self.now) & (Q(date_time__gt=self.now) | Q(id__gt=10))
+        self.assertNoSeqScan(Position.objects.filter(run=self.track_run).filter(after).order_by('date_time', 'id')[:51])
+
+    def test_runs_keyset_page(self):
+        after = Q(created_at__gte=self.now) & (Q(created_at__gt=self.now) | Q(id__gt=10))
+        self.assertNoSeqScan(Run.objects.filter(after).order_by('created_at', 'id')[:51])
+
+    def test_athlete_runs_by_status(self):
+        self.assertNoSeqScan(Run.objects.filter(athlete=self.athlete, status=Run.FINISHED))
+
+    def test_athlete_challenge(self):
+        self.assertNoSeqScan(Challenge.objects.filter(athlete=self.athlete, full_name='Челлендж 1'))
+
+    def test_collectibles_near_point(self):
+        queryset = CollectibleItem.objects.filter(cell__in=['5500:3700', '5500:3701']) \
+            .exclude(users__id=self.athlete.id)
+        self.assertNoSeqScan(queryset)
+
+    def test_next_finalize_job(self):
+        queryset = RunFinalizeJob.objects.filter(status=RunFinalizeJob.PENDING, run_after__lte=self.now)
+        self.assertNoSeqScan(queryset.order_by('run_after', 'id')[:1])
+
+    @skipUnless(connection.vendor == 'postgresql', 'поиск по подстроке индексом - только триграммы PostgreSQL')
+    def test_user_name_search(self):
+        self.assertNoSeqScan(User.objects.filter(Q(first_name__icontains='мя1') | Q(last_name__icontains='мя1')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class KeysetPaginationTests(TestCase):
+    # постраничный обход вперёд и назад по ссылкам next/previous даёт тот же порядок, что и полный список;
+    # NULL в поле сортировки идут после значений по возрастанию
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=cls.athlete, comment='', status=Run.IN_PROGRESS)
+        now = timezone.now()
+        # одинаковое время у соседних точек и точки без времени (импорт GPX без <time>)
+        times = [now, now, None, now + timedelta(seconds=1), None, now - timedelta(seconds=1), now, None]
+        cls.positions = Position.objects.bulk_create([
+            Position(run=cls.own_run, latitude=55.0, longitude=37.0, date_time=moment) for moment in times
+        ])
+        by_time = sorted(cls.positions, key=lambda p: (p.date_time is None, p.date_time or now, p.id))
+        cls.expected = [p.id for p in by_time]
+        cls.runs = Run.objects.bulk_create([Run(athlete=cls.athlete, comment=str(i)) for i in range(5)])
+        Run.objects.filter(pk__in=[run.pk for run in cls.runs[:3]]).update(created_at=now)  # одинаковое created_at
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url):
+        # id всех страниц вперёд, затем всех страниц назад от последней
+        forward, pages = [], []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([item['id'] for item in data['results']])
+            forward += pages[-1]
+            last, url = data, data['next']
+        backward = []
+        url = last['previous']
+        while url:
+            data = self.client.get(url).json()
+            backward = [item['id'] for item in data['results']] + backward
+            url = data['previous']
+        return forward, backward + pages[-1]
+
+    def test_positions_with_null_time(self):
+        forward, backward = self.walk(f'/api/positions/?run={self.own_run.id}&size=2')
+        self.assertEqual(forward, self.expected)
+        self.assertEqual(backward, self.expected)
+
+    def test_page_ends_on_null(self):
+        # страница из одной точки: курсор стоит на NULL
+        forward, backward = self.walk(f'/api/positions/?run={self.own_run.id}&size=1')
+        self.assertEqual(forward, self.expected)
+        self.assertEqual(backward, self.expected)
+
+    def test_runs_descending(self):
+        expected = list(Run.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        forward, backward = self.walk('/api/runs/?ordering=-created_at&size=2')
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_list_pagination_matches_queryset(self):
+        # paginate_list (точки из архива) обходит объекты в памяти в том же порядке, что и база
+        paginator = PositionKeysetPagination()
+        ids, params = [], {'size': '3'}
+        while True:
+            request = Request(RequestFactory().get('/api/positions/', params))
+            ids += [p.id for p in paginator.paginate_list(list(reversed(self.positions)), request, Position)]
+            if paginator.next_position is None:
+                break
+            link = paginator.encode_link(paginator.next_position, False)
+            params = {'cursor': parse_qs(urlparse(link).query)['cursor'][0]}
+        self.assertEqual(ids, self.expected)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   POSITION_WRITE_BEHIND=False)
+class PositionBatchTests(TestCase):
+    # пакетная загрузка точек: результат по каждой точке, 207 при частичном успехе, один забег на пакет
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=cls.athlete, comment='', status=Run.IN_PROGRESS)
+        cls.other_run = Run.objects.create(athlete=cls.athlete, comment='', status=Run.IN_PROGRESS)
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, items):
+        # последняя точка попадает в состояние приёма после коммита (app_run.ingest)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/positions/', items, content_type='application/json')
+
+    def point(self, second, latitude=55.75, run=None):
+        return {'run': (run or self.own_run).id, 'latitude': latitude, 'longitude': 37.62,
+                'date_time': f'2024-01-01T10:00:{second:02d}'}
+
+    def test_partial_success(self):
+        response = self.post([self.point(0), self.point(10, latitude=100.0), self.point(20, latitude=55.751)])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()], [201, 400, 201])
+        self.assertIn('latitude', response.json()[1]['errors'])
+        self.assertEqual(Position.objects.filter(run=self.own_run).count(), 2)
+
+    def test_all_valid(self):
+        response = self.post([self.point(0), self.point(10, latitude=55.751)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['data']['id'] for result in response.json()],
+                         list(Position.objects.filter(run=self.own_run).order_by('id').values_list('id', flat=True)))
+
+    def test_mixed_runs_rejected(self):
+        response = self.post([self.point(0), self.point(10, run=self.other_run)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('run', response.json())
+        self.assertFalse(Position.objects.exists())
+
+    def test_empty_batch_rejected(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Position.objects.exists())
+
+    def test_speed_continues_across_batches(self):
+        # у первой точки забега скорость и дистанция 0, следующий пакет продолжает от последней записанной точки
+        first = self.post([self.point(0), self.point(10, latitude=55.751)]).json()
+        self.assertEqual(first[0]['data']['speed'], 0.0)
+        self.assertEqual(first[0]['data']['distance'], 0.0)
+        self.assertGreater(first[1]['data']['speed'], 0.0)
+        second = self.post([self.point(20, latitude=55.752)]).json()
+        # ~111 м за 10 с
+        self.assertAlmostEqual(second[0]['data']['speed'], 11.1, delta=0.2)
+        self.assertAlmostEqual(second[0]['data']['distance'], 2 * first[1]['data']['distance'], delta=0.01)
+        self.own_run.refresh_from_db()
+        # в ответе дистанция округлена до 0.01 км
+        self.assertAlmostEqual(self.own_run.track_distance, second[0]['data']['distance'], delta=0.005)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   RUN_FINALIZE_ASYNC=True, POSITION_WRITE_BEHIND=False)
+class FinalizeQueueTests(TestCase):
+    # stop ставит задачу RunFinalizeJob, воркер переносит итоги в забег; упавшая задача повторяется с паузой
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        start = timezone.now() - timedelta(hours=1)
+        cls.own_run = Run.objects.create(
+            athlete=cls.athlete, comment='', status=Run.IN_PROGRESS, track_distance=1.5,
+            first_position_at=start, last_position_at=start + timedelta(seconds=600), speed_sum=5.0, speed_count=2,
+        )
+        Position.objects.bulk_create([
+            Position(run=cls.own_run, latitude=55.75 + i / 1e3, longitude=37.62, date_time=start + timedelta(seconds=i),
+                     speed=2.5, distance=i / 10)
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def stop(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/runs/{self.own_run.id}/stop/')
+
+    def test_stop_enqueues_job(self):
+        response = self.stop()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['finalize_status'], RunFinalizeJob.PENDING)
+        self.assertEqual(list(RunFinalizeJob.objects.values_list('run_id', 'status')),
+                         [(self.own_run.id, RunFinalizeJob.PENDING)])
+        self.own_run.refresh_from_db()
+        self.assertEqual(self.own_run.distance, 0)
+
+    def test_worker_finalizes_run(self):
+        self.stop()
+        self.assertTrue(process_next_job(max_attempts=5))
+        self.assertFalse(process_next_job(max_attempts=5))
+        self.own_run.refresh_from_db()
+        self.assertEqual(self.own_run.finalize_status, RunFinalizeJob.DONE)
+        self.assertEqual((self.own_run.distance, self.own_run.run_time_seconds, self.own_run.speed), (1.5, 600, 2.5))
+        self.assertEqual(RunFinalizeJob.objects.get().status, RunFinalizeJob.DONE)
+        self.assertEqual(RunTrack.objects.get(run=self.own_run).points, 3)
+
+    def test_failed_job_retried_then_failed(self):
+        self.stop()
+        with mock.patch('app_run.finalize.finalize_run', side_effect=RuntimeError('boom')):
+            self.assertTrue(process_next_job(max_attempts=2))
+            job = RunFinalizeJob.objects.get()
+            self.assertEqual((job.status, job.attempts), (RunFinalizeJob.PENDING, 1))
+            self.assertIn('boom', job.last_error)
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertFalse(process_next_job(max_attempts=2))  # пауза перед повтором ещё не прошла
+
+            RunFinalizeJob.objects.update(run_after=timezone.now())
+            self.assertTrue(process_next_job(max_attempts=2))
+        self.assertEqual(RunFinalizeJob.objects.get().status, RunFinalizeJob.FAILED)
+        self.own_run.refresh_from_db()
+        self.assertEqual(self.own_run.finalize_status, RunFinalizeJob.FAILED)
+
+    def test_stale_job_requeued(self):
+        job = RunFinalizeJob.objects.create(run=self.own_run, status=RunFinalizeJob.PROCESSING,
+                                            locked_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(requeue_stale_jobs(stale_after=300), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_at), (RunFinalizeJob.PENDING, None))
+
+
+class TrackCodecTests(SimpleTestCase):
+    # формат RunTrack без потерь: декодирование возвращает ровно те строки, что были закодированы
+
+    def test_round_trip(self):
+        start = datetime(2024, 1, 1, 10, 0, 0, 123456, tzinfo=dt_timezone.utc)
+        rows = [
+            (7, 55.123456789012, 37.987654321098, start, 0.0, 0.0),
+            (9, 55.1235, -0.000001, start + timedelta(microseconds=1), 3.3333333333333335, 0.0123),
+            (10, -33.9, 151.2, None, None, None),  # точка без времени, скорости и дистанции
+            (250000, 89.999999, -179.999999, start - timedelta(days=400), 12.5, 1e-12),
+        ]
+        self.assertEqual(decode_track(encode_track(rows)), rows)
+
+    def test_empty_track(self):
+        self.assertEqual(decode_track(encode_track([])), [])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            decode_track(b'XYZ' + encode_track([])[3:])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   POSITION_WRITE_BEHIND=False)
+class ArchiveTests(TestCase):
+    # archive_positions --days N оставляет старым забегам только трек без потерь,
+    # список точек ?run= после этого отдаётся из трека тем же, что и из таблицы
+
+    @classmethod
+    def setUpTestData(cls):
+        athlete = User.objects.create(username='athlete')
+        now = timezone.now()
+        cls.old_run, cls.fresh_run = [
+            Run.objects.create(athlete=athlete, comment='', status=Run.FINISHED,
+                               finalize_status=RunFinalizeJob.DONE, last_position_at=last)
+            for last in (now - timedelta(days=200), now)
+        ]
+        times = [now, now, None, now + timedelta(microseconds=1), now - timedelta(seconds=1)]
+        for own_run in (cls.old_run, cls.fresh_run):
+            Position.objects.bulk_create([
+                Position(run=own_run, latitude=55.75 + i / 1e5, longitude=37.62, date_time=moment,
+                         speed=None if moment is None else i / 3, distance=i / 7)
+                for i, moment in enumerate(times)
+            ])
+
+    def setUp(self):
+        cache.clear()
+
+    def archive(self, days=90):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_positions', days=days, stdout=StringIO())
+
+    def positions(self, query=''):
+        return self.client.get(f'/api/positions/?run={self.old_run.id}{query}').json()
+
+    def test_only_old_runs_archived(self):
+        self.archive()
+        self.assertFalse(Position.objects.filter(run=self.old_run).exists())
+        self.assertEqual(Position.objects.filter(run=self.fresh_run).count(), 5)
+        self.assertIsNotNone(RunTrack.objects.get(run=self.old_run).archived_at)
+        self.assertFalse(RunTrack.objects.filter(run=self.fresh_run).exists())
+        self.assertEqual(archive_run(self.old_run.id), 0)  # повторный запуск ничего не делает
+
+    def test_run_list_restored_from_track(self):
+        before, first_page = self.positions(), self.positions('&size=2')
+        cursor = parse_qs(urlparse(first_page['next']).query)['cursor'][0]
+        second_page = self.positions(f'&size=2&cursor={cursor}')
+        self.archive()
+        self.assertEqual(self.positions(), before)
+        self.assertEqual(self.positions('&size=2'), first_page)
+        self.assertEqual(self.positions(f'&size=2&cursor={cursor}'), second_page)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   POSITION_WRITE_BEHIND=False)
+class ResponseCacheTests(TestCase):
+    # закэшированный ответ живёт, пока не изменились модели, от которых он зависит (app_run.caching)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=cls.athlete, comment='до', status=Run.FINISHED)
+        cls.positions = Position.objects.bulk_create([
+            Position(run=cls.own_run, latitude=55.75 + i / 1e3, longitude=37.62 + (i % 2) / 1e3,
+                     date_time=timezone.now() + timedelta(seconds=i))
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def comment(self):
+        return self.client.get(f'/api/runs/{self.own_run.id}/').json()['comment']
+
+    def test_cached_until_save(self):
+        self.assertEqual(self.comment(), 'до')
+        Run.objects.filter(pk=self.own_run.pk).update(comment='после')  # update() без сигналов версию не меняет
+        self.assertEqual(self.comment(), 'до')
+        with self.captureOnCommitCallbacks(execute=True):
+            Run.objects.get(pk=self.own_run.pk).save()
+        self.assertEqual(self.comment(), 'после')
+
+    def test_collectible_list_after_create(self):
+        self.assertEqual(self.client.get('/api/collectible_item/').json(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            CollectibleItem.objects.create(name='монета', uid='1', latitude=55.0, longitude=37.0,
+                                           picture='https://example.com/1.png', value=1)
+        self.assertEqual([item['uid'] for item in self.client.get('/api/collectible_item/').json()], ['1'])
+
+    def test_track_after_position_delete(self):
+        url = f'/api/runs/{self.own_run.id}/track/?zoom=22'
+        self.assertEqual(len(self.client.get(url).json()), 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/positions/{self.positions[2].id}/').status_code, 204)
+        self.assertEqual(len(self.client.get(url).json()), 4)
+
+    def test_positions_deleted_in_one_query(self):
+        # без приёмников post_delete у Position каскад от забега удаляет точки одним DELETE
+        self.assertFalse(post_delete.has_listeners(Position))
+        with self.captureOnCommitCallbacks() as callbacks:
+            Run.objects.get(pk=self.own_run.pk).delete()
+        self.assertFalse(Position.objects.exists())
+        self.assertLess(len(callbacks), 10)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   POSITION_WRITE_BEHIND=False)
+class IngestSessionTests(TestCase):
+    # забег, последняя точка и собранные предметы берутся из состояния приёма в кэше (app_run.ingest)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=cls.athlete, comment='', status=Run.IN_PROGRESS)
+
+    def setUp(self):
+        cache.clear()
+
+    def post(self, second):
+        point = {'run': self.own_run.id, 'latitude': 55.75 + second / 1e4, 'longitude': 37.62,
+                 'date_time': f'2024-01-01T10:00:{second:02d}'}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/positions/', point, content_type='application/json')
+
+    def test_no_lookups_after_first_point(self):
+        self.assertEqual(self.post(0).status_code, 201)
+        with CaptureQueriesContext(connection) as context:
+            response = self.post(10)
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(response.json()['speed'], 0)  # предыдущая точка - из состояния
+        selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertFalse([sql for sql in selects if 'app_run_run' in sql or 'app_run_position' in sql], selects)
+
+    def test_stop_resets_session(self):
+        self.post(0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/runs/{self.own_run.id}/stop/')
+        self.assertEqual(get_session(self.own_run.id)['status'], Run.FINISHED)
+        self.assertEqual(self.post(10).status_code, 400)
+
+    def test_unknown_run(self):
+        self.assertIsNone(get_session(self.own_run.id + 1000))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   POSITION_WRITE_BEHIND=True, POSITION_FLUSH_INTERVAL_MS=10 ** 9, POSITION_FLUSH_ROWS=10 ** 6)
+class WriteBehindTests(TestCase):
+    # отложенная запись (app_run.buffer): точки ждут в журнале и попадают в базу одной пачкой при flush.
+    # Поток буфера в тестах спит (интервал и порог огромные), flush вызывается явно
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=cls.athlete, comment='', status=Run.IN_PROGRESS)
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        override = override_settings(POSITION_BUFFER_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def tearDown(self):
+        if buffer._buffer is not None:
+            atexit.unregister(buffer._buffer.close)
+            buffer._buffer.close()
+            buffer._buffer = None
+
+    def post(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/positions/', items, content_type='application/json')
+
+    def points(self, count):
+        return [{'run': self.own_run.id, 'latitude': 55.75 + i / 1e4, 'longitude': 37.62,
+                 'date_time': f'2024-01-01T10:00:{i:02d}'} for i in range(count)]
+
+    def test_flush_writes_batch(self):
+        response = self.post(self.points(3))
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(len(buffer.buffered_points(self.own_run.id)), 3)
+        # ещё не записанные точки уже видны в списке забега, без id
+        listed = self.client.get(f'/api/positions/?run={self.own_run.id}').json()
+        self.assertEqual([p['id'] for p in listed], [None] * 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            buffer.flush_local()
+        self.assertEqual(Position.objects.filter(run=self.own_run).count(), 3)
+        self.assertEqual(buffer.buffered_points(self.own_run.id), [])
+        self.own_run.refresh_from_db()
+        self.assertAlmostEqual(self.own_run.track_distance, 0.022, delta=0.001)
+        self.assertEqual(self.own_run.speed_count, 3)
+
+    def test_orphan_segment_replayed_once(self):
+        # сегмент упавшего процесса: одна точка уже в базе (упал между коммитом и удалением сегмента)
+        now = timezone.now()
+        stored, lost = [
+            buffer.buffered_point(Position(run_id=self.own_run.id, latitude=55.75 + i / 1e4, longitude=37.62,
+                                           date_time=now + timedelta(seconds=i), speed=0.0, distance=0.0),
+                                  self.athlete.id, 0.0)
+            for i in range(2)
+        ]
+        buffer.write_points([stored])
+        with open(os.path.join(self.directory, '1-1.sealed'), 'w', encoding='utf-8') as file:
+            file.write(''.join(buffer._encode(point) + '\n' for point in (stored, lost)))
+        orphan_buffer = buffer.get_buffer()
+        orphan_buffer.replay_orphans()
+        self.assertEqual(orphan_buffer.flush(), 1)
+        self.assertEqual(Position.objects.filter(run=self.own_run).count(), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '1-1.sealed')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   RUN_MOVING_SPEED=0.5, RUN_PACE_ZONES=[240, 270, 300, 330, 360, 420])
+class RunAnalyticsTests(TestCase):
+    # отрезки по километру, время движения и зоны темпа (app_run.splits) на треке с известным темпом:
+    # 2450 м по 50 м за 10 с (темп 200 с/км), минута стоянки, 200 м по 20 м за 10 с (500 с/км)
+
+    @classmethod
+    def setUpTestData(cls):
+        athlete = User.objects.create(username='athlete')
+        cls.own_run = Run.objects.create(athlete=athlete, comment='', status=Run.FINISHED,
+                                         finalize_status=RunFinalizeJob.DONE)
+        degree_m = path_distances_m([55.0, 55.001], [37.0, 37.0])[0] * 1000
+        latitudes = [55.0 + i * 50 / degree_m for i in range(50)]
+        latitudes += [latitudes[-1]] * 6
+        latitudes += [latitudes[-1] + i * 20 / degree_m for i in range(1, 11)]
+        start = timezone.now() - timedelta(hours=1)
+        Position.objects.bulk_create([
+            Position(run=cls.own_run, latitude=latitude, longitude=37.0, date_time=start + timedelta(seconds=10 * i))
+            for i, latitude in enumerate(latitudes)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def analytics(self, run_id):
+        return self.client.get(f'/api/runs/{run_id}/analytics/')
+
+    def test_splits_and_zones(self):
+        data = self.analytics(self.own_run.id).json()
+        self.assertAlmostEqual(data['distance_km'], 2.65, delta=0.005)
+        self.assertEqual(data['elapsed_time_seconds'], 650)
+        self.assertEqual(data['moving_time_seconds'], 590)
+        self.assertEqual([split['km'] for split in data['splits']], [1, 2, 3])
+        for split, (distance_m, seconds) in zip(data['splits'], [(1000, 200), (1000, 200), (650, 250)]):
+            self.assertAlmostEqual(split['distance_m'], distance_m, delta=5)
+            self.assertAlmostEqual(split['seconds'], seconds, delta=1)
+        self.assertAlmostEqual(data['splits'][0]['pace'], 200, delta=1)
+        self.assertEqual([zone['seconds'] for zone in data['pace_zones']], [490, 0, 0, 0, 0, 0, 100])
+        self.assertEqual((data['pace_zones'][0]['from'], data['pace_zones'][0]['to']), (None, 240))
+        self.assertEqual((data['pace_zones'][-1]['from'], data['pace_zones'][-1]['to']), (420, None))
+
+    def test_not_ready(self):
+        Run.objects.filter(pk=self.own_run.pk).update(finalize_status=RunFinalizeJob.PENDING)
+        self.assertEqual(self.analytics(self.own_run.id).status_code, 400)
+
+    def test_unknown_run(self):
+        self.assertEqual(self.analytics(self.own_run.id + 1000).status_code, 404)
+        self.assertEqual(self.analytics('abc').status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   HEATMAP_MAX_ZOOM=3, HEATMAP_CELLS=4)
+class HeatmapTests(TestCase):
+    # на zoom 3 мир - 32 x 32 ячейки: точка (0, 0) попадает в ячейку (16, 16), (60, 90) - в (24, 9)
+
+    @classmethod
+    def setUpTestData(cls):
+        athlete = User.objects.create(username='athlete')
+        cls.runs = [Run.objects.create(athlete=athlete, comment='', status=Run.FINISHED,
+                                       finalize_status=RunFinalizeJob.DONE) for _ in range(2)]
+        for own_run in cls.runs:
+            Position.objects.bulk_create([
+                Position(run=own_run, latitude=latitude, longitude=longitude)
+                for latitude, longitude in [(0.0, 0.0), (0.0, 0.0), (60.0, 90.0)]
+            ])
+
+    def setUp(self):
+        cache.clear()
+
+    def add_run(self, own_run):
+        with self.captureOnCommitCallbacks(execute=True):
+            add_run_to_heatmap(own_run.id)
+
+    def cells(self):
+        return {(cell.zoom, cell.x, cell.y): (cell.runs, cell.points) for cell in HeatmapCell.objects.all()}
+
+    def test_run_cells(self):
+        cells = run_cells([{'latitude': 0.0, 'longitude': 0.0}] * 2 + [{'latitude': 60.0, 'longitude': 90.0}])
+        self.assertEqual(cells[(3, 16, 16)], 2)
+        self.assertEqual(cells[(3, 24, 9)], 1)
+        self.assertEqual(cells[(0, 2, 2)], 2)
+        self.assertEqual(cells[(0, 3, 1)], 1)
+        self.assertEqual(len(cells), 8)
+
+    def test_runs_accumulate_and_rebuild(self):
+        for own_run in self.runs:
+            self.add_run(own_run)
+        self.assertEqual(self.cells()[(3, 16, 16)], (2, 4))
+        expected = self.cells()
+        self.add_run(self.runs[0])  # повторная постобработка считает забег дважды, rebuild исправляет
+        self.assertEqual(self.cells()[(3, 16, 16)], (3, 6))
+        self.assertEqual(rebuild_heatmap(), 2)
+        self.assertEqual(self.cells(), expected)
+
+    def test_tile_etag(self):
+        self.add_run(self.runs[0])
+        response = self.client.get('/api/heatmap/0/0/0/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['cells']), [[2, 2, 1, 2], [3, 1, 1, 1]])
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/api/heatmap/0/0/0/', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.add_run(self.runs[1])
+        response = self.client.get('/api/heatmap/0/0/0/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(sorted(response.json()['cells']), [[2, 2, 2, 4], [3, 1, 2, 2]])
+
+    def test_tile_out_of_range(self):
+        self.assertEqual(self.client.get('/api/heatmap/4/0/0/').status_code, 404)
+        self.assertEqual(self.client.get('/api/heatmap/1/2/0/').status_code, 404)
@@ -0,0 +1,140 @@
+from django.db.models import F, Value, Min, Max, Sum, Count
+from django.db.models.functions import Coalesce, Least, Greatest
+
+from app_run.caching import bump_version
+from app_run.models import Run, Position, AthleteStats, RunFinalizeJob
+
+# Итоги забега (дистанция, время, средняя скорость) копятся при записи точек,
+# поэтому stop забега не перечитывает трек из базы.
+
+TOTAL_FIELDS = ['track_distance', 'first_position_at', 'last_position_at', 'speed_sum', 'speed_count']
+# в итогах атлета учтены законченные забеги после постобработки ('' - законченные до очереди RunFinalizeJob)
+COUNTED_FINALIZE = ['', RunFinalizeJob.DONE]
+
+
+def run_totals_updates(positions, distance_km):
+    # F-выражения для UPDATE итогов забега на только что записанные точки,
+    # они не теряют данные при параллельной записи точек
+    speeds = [position.speed for position in positions if position.speed is not None]
+    times = [position.date_time for position in positions if position.date_time]
+    updates = {
+        'track_distance': F('track_distance') + distance_km,
+        'speed_sum': F('speed_sum') + sum(speeds),
+        'speed_count': F('speed_count') + len(speeds),
+    }
+    if times:
+        first, last = Value(min(times)), Value(max(times))
+        updates['first_position_at'] = Least(Coalesce('first_position_at', first), first)
+        updates['last_position_at'] = Greatest(Coalesce('last_position_at', last), last)
+    return updates
+
+
+def add_to_run_totals(run_id, positions, distance_km):
+    # одним UPDATE наращивает итоги забега на только что записанные точки
+    Run.objects.filter(pk=run_id).update(**run_totals_updates(positions, distance_km))
+    bump_version(Run)
+
+
+def apply_run_totals(run):
+    # переносит накопленные итоги в поля законченного забега, сохранение остаётся за вызывающим
+    run.distance = run.track_distance
+    if run.first_position_at and run.last_position_at:
+        run.run_time_seconds = int((run.last_position_at - run.first_position_at).total_seconds())
+    if run.speed_count:
+        run.speed = round(run.speed_sum / run.speed_count, 2)
+
+
+def recompute_run_totals(run_id):
+    # итоги забега, пересчитанные заново по сырым точкам - для сверки с накопленными
+    from app_run.distance import path_distances_m  # numpy не грузим при старте процесса
+
+    positions = Position.objects.filter(run_id=run_id).order_by('id')
+    points = list(positions.values_list('latitude', 'longitude'))
+    if not points:
+        archived = _archived_totals(run_id)
+        if archived is not None:
+            return archived
+    latitudes, longitudes = zip(*points) if points else ((), ())
+    result = positions.aggregate(
+        first_position_at=Min('date_time'),
+        last_position_at=Max('date_time'),
+        speed_sum=Coalesce(Sum('speed'), 0.0),
+        speed_count=Count('speed'),
+    )
+    result['track_distance'] = float(path_distances_m(latitudes, longitudes).sum()) / 1000
+    return result
+
+
+def _archived_totals(run_id):
+    # то же по точкам из архива (app_run.archive); None - забег не в архиве
+    from app_run.archive import archived_rows
+    from app_run.distance import path_distances_m
+
+    rows = archived_rows(run_id)
+    if not rows:
+        return None
+    _, latitudes, longitudes, times, speeds, _ = zip(*rows)
+    times = [moment for moment in times if moment is not None]
+    speeds = [speed for speed in speeds if speed is not None]
+    return {
+        'first_position_at': min(times, default=None),
+        'last_position_at': max(times, default=None),
+        'speed_sum': float(sum(speeds)),
+        'speed_count': len(speeds),
+        'track_distance': float(path_distances_m(latitudes, longitudes).sum()) / 1000,
+    }
+
+
+def add_run_to_athlete_stats(run):
+    # добавляет законченный забег в итоги атлета; вызывается в транзакции постобработки
+    AthleteStats.objects.get_or_create(user_id=run.athlete_id)
+    AthleteStats.objects.filter(user_id=run.athlete_id).update(
+        runs_finished=F('runs_finished') + 1,
+        total_distance=F('total_distance') + (run.distance or 0.0),
+        total_time_seconds=F('total_time_seconds') + run.run_time_seconds,
+        last_run=run,
+    )
+    bump_version(AthleteStats)
+    return AthleteStats.objects.get(user_id=run.athlete_id)
+
+
+STATS_AGGREGATES = {
+    'runs_finished': Count('id'),
+    'total_distance': Coalesce(Sum('distance'), 0.0),
+    'total_time_seconds': Coalesce(Sum('run_time_seconds'), 0),
+    'last_run_id': Max('id'),
+}
+
+
+def is_counted(run):
+    # учтён ли забег в итогах атлета
+    return run.status == Run.FINISHED and run.finalize_status in COUNTED_FINALIZE
+
+
+def counted_runs():
+    return Run.objects.filter(status=Run.FINISHED, finalize_status__in=COUNTED_FINALIZE)
+
+
+def refresh_athlete_stats(athlete_id):
+    # пересчитывает итоги одного атлета по его учтённым забегам - после удаления учтённого забега
+    # или правки его статуса, дистанции, времени; вызывается в транзакции изменения забега.
+    # Запись итогов не создаётся у атлета без учтённых забегов: при удалении пользователя она удаляется каскадом
+    row = counted_runs().filter(athlete_id=athlete_id).aggregate(**STATS_AGGREGATES)
+    if not AthleteStats.objects.filter(user_id=athlete_id).update(**row) and row['runs_finished']:
+        AthleteStats.objects.create(user_id=athlete_id, **row)
+    bump_version(AthleteStats)
+
+
+def rebuild_athlete_stats():
+    # пересчитывает итоги атлетов по учтённым забегам одним запросом агрегации и одним upsert
+    rows = counted_runs().values('athlete_id').annotate(**STATS_AGGREGATES)
+    stats = [AthleteStats(user_id=row.pop('athlete_id'), **row) for row in rows]
+    AthleteStats.objects.exclude(user_id__in=[item.user_id for item in stats]).update(
+        runs_finished=0, total_distance=0.0, total_time_seconds=0, last_run=None
+    )
+    AthleteStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=['user'],
+        update_fields=['runs_finished', 'total_distance', 'total_time_seconds', 'last_run'],
+    )
+    bump_version(AthleteStats)
+    return len(stats)
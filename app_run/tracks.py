@@ -0,0 +1,203 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.utils import timezone as django_timezone
+
+from app_run.models import Position, RunTrack
+
+# Компактный трек законченного забега: все точки в одном сжатом бинарном поле RunTrack.data.
+# Трек хранит точки без потерь (id, время в мкс, float как есть), поэтому архивация
+# (app_run.archive) удаляет строки Position забега, и дальше точки читаются только из трека.
+#
+# Формат v2: заголовок '<3sBI' (b'TRK', версия, число точек), дальше zlib(маска null uint8 +
+# дельты id int64 + дельты времени в мкс int64 + latitude, longitude, speed, distance float64).
+# Байты float64 переставлены плоскостями (сначала все старшие байты, затем следующие):
+# знак и порядок у соседних точек совпадают, и zlib сжимает их заметно лучше.
+# Формат v1 (заголовок '<3sBIB', колонки квантованы в целые, без id) по-прежнему читается.
+
+MAGIC = b'TRK'
+VERSION = 2
+HEADER = struct.Struct('<3sBI')
+ROW_COLUMNS = ['id', 'latitude', 'longitude', 'date_time', 'speed', 'distance']  # строки трека
+COLUMNS = ROW_COLUMNS[1:]  # точки трека для карты и аналитики
+FLOAT_COLUMNS = ['latitude', 'longitude', 'speed', 'distance']
+NULL_BITS = {'date_time': 1, 'speed': 2, 'distance': 4}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+HEADER_V1 = struct.Struct('<3sBIB')
+SCALES_V1 = [1e6, 1e6, None, 100, 100]
+
+MAX_ZOOM = 22
+TOLERANCE_PX = 1  # точки, смещающие линию меньше чем на пиксель карты, не нужны
+METERS_PER_PX_Z0 = 156543.03392  # метров в пикселе на экваторе при zoom 0 (тайлы 256 px)
+
+
+def _shuffle(values):
+    return values.astype('<f8').view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def _unshuffle(data, count):
+    return np.frombuffer(data, dtype=np.uint8).reshape(8, count).T.copy().view('<f8').ravel()
+
+
+def encode_track(rows):
+    # rows - кортежи ROW_COLUMNS в порядке id
+    count = len(rows)
+    mask = np.zeros(count, dtype=np.uint8)
+    for column, bit in NULL_BITS.items():
+        index = ROW_COLUMNS.index(column)
+        mask |= np.array([row[index] is None for row in rows], dtype=np.uint8) * bit
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    # время в мкс от эпохи целым числом: timestamp() через float потерял бы микросекунды
+    times = np.array([(row[3] - EPOCH) // timedelta(microseconds=1) if row[3] is not None else 0 for row in rows],
+                     dtype=np.int64)
+    payload = [mask.tobytes(), np.diff(ids, prepend=0).tobytes(), np.diff(times, prepend=0).tobytes()]
+    for column in FLOAT_COLUMNS:
+        index = ROW_COLUMNS.index(column)
+        payload.append(_shuffle(np.array([row[index] or 0.0 for row in rows], dtype=float)))
+    return HEADER.pack(MAGIC, VERSION, count) + zlib.compress(b''.join(payload), 6)
+
+
+def decode_track(data):
+    # обратно в кортежи ROW_COLUMNS; у треков v1 id нет (None), значения округлены
+    data = bytes(data)
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError('Неизвестный формат трека')
+    if version == 1:
+        return _decode_track_v1(data)
+    payload = zlib.decompress(data[HEADER.size:])
+    if not count:
+        return []
+    mask = np.frombuffer(payload, dtype=np.uint8, count=count)
+    offset = count
+    ids = np.frombuffer(payload, dtype=np.int64, count=count, offset=offset).cumsum().tolist()
+    offset += count * 8
+    times = np.frombuffer(payload, dtype=np.int64, count=count, offset=offset).cumsum().tolist()
+    offset += count * 8
+    floats = {}
+    for column in FLOAT_COLUMNS:
+        floats[column] = _unshuffle(payload[offset:offset + count * 8], count).tolist()
+        offset += count * 8
+
+    rows = []
+    for index in range(count):
+        null = mask[index]
+        rows.append((
+            ids[index],
+            floats['latitude'][index],
+            floats['longitude'][index],
+            EPOCH + timedelta(microseconds=times[index]) if not null & NULL_BITS['date_time'] else None,
+            floats['speed'][index] if not null & NULL_BITS['speed'] else None,
+            floats['distance'][index] if not null & NULL_BITS['distance'] else None,
+        ))
+    return rows
+
+
+def _decode_track_v1(data):
+    # v1: первые значения колонок int64 + дельты int32/int64, координаты 1e-6°, время в мс, остальное в сотых
+    _, _, count, itemsize = HEADER_V1.unpack_from(data)
+    payload = zlib.decompress(data[HEADER_V1.size:])
+    if not count:
+        return []
+    mask = np.frombuffer(payload, dtype=np.uint8, count=count)
+    first = np.frombuffer(payload, dtype=np.int64, count=len(COLUMNS), offset=count).reshape(len(COLUMNS), 1)
+    dtype = np.int32 if itemsize == 4 else np.int64
+    deltas = np.frombuffer(payload, dtype=dtype, offset=count + first.nbytes).reshape(len(COLUMNS), count - 1)
+    values = np.hstack([first, deltas.astype(np.int64)]).cumsum(axis=1).tolist()
+
+    rows = []
+    for index in range(count):
+        row = [None]
+        for column_index, column in enumerate(COLUMNS):
+            value = values[column_index][index]
+            if mask[index] & NULL_BITS.get(column, 0):
+                row.append(None)
+            elif column == 'date_time':
+                row.append(datetime.fromtimestamp(value / 1000, tz=timezone.utc))
+            else:
+                row.append(value / SCALES_V1[column_index])
+        rows.append(tuple(row))
+    return rows
+
+
+def save_run_track(run_id, archived=False):
+    # кодирует точки забега в RunTrack, вызывается при постобработке законченного забега и при архивации.
+    # Если строки забега уже удалялись архивацией, точки трека и оставшиеся в Position объединяются по id
+    rows = list(Position.objects.filter(run_id=run_id).order_by('id').values_list(*ROW_COLUMNS))
+    track = RunTrack.objects.filter(run_id=run_id).only('archived_at', 'data').first()
+    archived_at = track.archived_at if track is not None else None
+    if archived_at is not None:
+        merged = {row[0]: row for row in decode_track(track.data)}
+        merged.update((row[0], row) for row in rows)
+        rows = [merged[key] for key in sorted(merged)]
+    if archived and archived_at is None:
+        archived_at = django_timezone.now()
+    track, _ = RunTrack.objects.update_or_create(run_id=run_id, defaults={
+        'points': len(rows),
+        'data': encode_track(rows),
+        'archived_at': archived_at,
+    })
+    return track
+
+
+def track_rows(run_id):
+    # кортежи ROW_COLUMNS забега, чьи строки Position удалены архивацией; [] - забег не в архиве
+    track = RunTrack.objects.filter(run_id=run_id, archived_at__isnull=False).only('data').first()
+    return decode_track(track.data) if track is not None else []
+
+
+def run_track_points(run_id):
+    # точки забега словарями COLUMNS: из RunTrack одной строкой, а если трека ещё нет (забег идёт) - из Position
+    track = RunTrack.objects.filter(run_id=run_id).only('data').first()
+    if track is not None:
+        return [dict(zip(COLUMNS, row[1:])) for row in decode_track(track.data)]
+    rows = Position.objects.filter(run_id=run_id).order_by('id').values_list(*COLUMNS)
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def zoom_tolerance_m(zoom, latitude):
+    # допуск упрощения в метрах: размер пикселя веб-карты на этой широте и zoom
+    return TOLERANCE_PX * METERS_PER_PX_Z0 * np.cos(np.radians(latitude)) / 2 ** zoom
+
+
+def douglas_peucker(x, y, tolerance):
+    # маска оставляемых точек, алгоритм Дугласа-Пекера без рекурсии
+    count = len(x)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        px, py = x[start + 1:end], y[start + 1:end]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length = dx * dx + dy * dy
+        # расстояние до отрезка, а не до прямой: у кольцевого трека начало и конец совпадают
+        t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length, 0, 1) if length else 0
+        distances = np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = start + 1 + index
+            keep[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return keep
+
+
+def simplify_track(points, zoom):
+    # упрощает трек под масштаб карты, координаты переводятся в метры локальной плоской проекции
+    if len(points) < 3:
+        return points
+    latitudes = np.array([point['latitude'] for point in points])
+    longitudes = np.array([point['longitude'] for point in points])
+    middle_latitude = float(latitudes.mean())
+    x = np.radians(longitudes) * 6371008.8 * np.cos(np.radians(middle_latitude))
+    y = np.radians(latitudes) * 6371008.8
+    keep = douglas_peucker(x, y, zoom_tolerance_m(zoom, middle_latitude))
+    return [point for point, kept in zip(points, keep) if kept]
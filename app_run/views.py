@@ -1,110 +1,85 @@
-import openpyxl
-from django.db.models import Sum, Q, Min, Max, Count, Avg
-from django.forms import model_to_dict
-from django.shortcuts import render, get_object_or_404
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q, F
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse, Http404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET, condition
 from django_filters.rest_framework import DjangoFilterBackend
-from geopy import Point
-from geopy.distance import geodesic
-from datetime import datetime
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, action
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.generics import get_object_or_404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.response import Response
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
-from dateutil import parser
 
-from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem
+from app_run.models import Run, AthleteInfo, Challenge, Position, CollectibleItem, RunFinalizeJob, \
+    RunTrack, AthleteStats, RunSplits, HeatmapCell
 from app_run.serializers import RunSerializer, UserSerializer, RunStatus, AthleteInfoSerializer, ChallengeSerializer, \
-    PositionSerializer, CollectibleSerializer, UserDetailSerializer
-from geopy.distance import geodesic
-
-
-def all_positions_speed(run_id):
-    items = Position.objects.filter(run__id=run_id).aggregate(Avg('speed'))
-    res = round(items['speed__avg'], 2)
-    athlete = Run.objects.get(pk=run_id)
-    athlete.speed = res
-    athlete.save()
-
-
-def check_runs(run_id):
-    # проверяет, сделал ли атлет ровно 10 забегов, если да, то создается запись в таблице Challenge
-    item = Run.objects.get(pk=run_id).athlete
-    serializer = UserSerializer(item)
-    count_runs = serializer.data['runs_finished']
-    if count_runs == 10:
-        new_challange = Challenge.objects.create(
-            full_name='Сделай 10 Забегов!',
-            athlete=item
+    PositionSerializer, CollectibleSerializer, UserDetailSerializer, PositionBatchItemSerializer
+from app_run.spatial import cells_around, COLLECT_RADIUS_KM
+from app_run.totals import add_to_run_totals, is_counted, refresh_athlete_stats
+from app_run.finalize import enqueue_finalize, finalize_run
+from app_run.caching import cache_response, bump_version, model_versions, RUN_TRACK
+from app_run.exports import filter_runs, export_stream, CONTENT_TYPES
+from app_run.live import Feed, event_stream, async_event_stream, publish_positions
+from app_run.buffer import accept_positions, buffered_positions, flush_local, PendingPoints
+from app_run.ingest import get_session, session_run, last_position, remember_positions, remember_collected, \
+    cell_items, forget_session
+
+# numpy (app_run.distance, app_run.tracks) и openpyxl (app_run.importers) импортируются
+# внутри view, которым они нужны: на Lambda каждый холодный старт грузит модуль views целиком,
+# а большинству запросов эти библиотеки не нужны. Время импорта: python manage.py startup_benchmark
+
+
+def search_collectible(run, points):
+    # ищет предметы в радиусе 100 м от точек забега и добавляет найденные атлету одной записью:
+    # предметы соседних ячеек сетки и уже собранные атлетом берутся из кэша (app_run.ingest)
+    from app_run.distance import distances_m
+
+    points_by_cell = {}
+    for latitude, longitude in points:
+        for cell in cells_around(latitude, longitude):
+            points_by_cell.setdefault(cell, []).append((latitude, longitude))
+    if not points_by_cell:
+        return
+
+    state = get_session(run.id)
+    collected = state['collected'] if state is not None else set()
+    found = []
+    for cell, items in cell_items(points_by_cell).items():
+        items = [item for item in items if item[0] not in collected]
+        if not items:
+            continue
+        cell_points = points_by_cell[cell]
+        item_ids, item_latitudes, item_longitudes = zip(*items)
+        # матрица расстояний точки x предметы ячейки: точки столбцом, предметы строкой
+        near = distances_m([[latitude] for latitude, _ in cell_points], [[longitude] for _, longitude in cell_points],
+                           item_latitudes, item_longitudes)
+        found += [item_id for item_id, hit in zip(item_ids, (near < COLLECT_RADIUS_KM * 1000).any(axis=0)) if hit]
+    if found:
+        CollectibleItem.users.through.objects.bulk_create(
+            [CollectibleItem.users.through(collectibleitem_id=item_id, user_id=run.athlete_id) for item_id in found],
+            ignore_conflicts=True
         )
-        new_challange.save()
-
-
-def total_running_time_in_seconds(run_id):
-    result = Position.objects.filter(run__id=run_id).aggregate(
-        first_date=Min('date_time'),
-        last_date=Max('date_time')
-    )
-    if result['last_date'] and result['first_date']:
-        duration = result['last_date'] - result['first_date']
-        total_seconds = int(duration.total_seconds())
-        res = Run.objects.get(pk=run_id)
-        res.run_time_seconds = total_seconds
-        res.save()
-
-
-def count_distance(run_id):
-    # запускается после stop забега и высчитывает расстояние, которое побежал атлет
-    distance_field = Run.objects.get(pk=run_id)
-    positions = Position.objects.filter(run__id=run_id)
-    points = []
-    for position in positions:
-        points.append((position.latitude, position.longitude))
+        bump_version(CollectibleItem)  # bulk_create не шлёт m2m_changed
+        remember_collected(run.id, found)
 
-    distance = geodesic(*points).kilometers
 
-    distance_field.distance = distance
-    distance_field.save()
-
-
-def search_collectible(coordinates):
-    collectible_items = CollectibleItem.objects.all()
-    current_point = Point(coordinates['latitude'], coordinates['longitude'])
-    for i in collectible_items:
-        latitude = i.latitude
-        longitude = i.longitude
-
-        if not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
-            continue
-        else:
-            point = (latitude, longitude)
-            distance_between_two_points = geodesic(current_point, point).kilometers
-
-        if distance_between_two_points < 0.1:
-            run = Run.objects.get(id=coordinates['run'])
-            user = User.objects.get(username=run)
-            i.users.add(user)
-
-
-def check_50_km(run_id):
-    item = Run.objects.get(pk=run_id).athlete
-    sum = Run.objects.filter(athlete=item).aggregate(Sum('distance'))
-    challenge = Challenge.objects.filter(athlete=item)
-    for i in challenge:
-        if i.full_name == 'Пробеги 50 километров!':
-            return
-    if sum['distance__sum'] >= 50:
-        new_challange = Challenge.objects.create(
-            full_name='Пробеги 50 километров!',
-            athlete=item
-        )
-        new_challange.save()
+TRACK_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'  # как у PositionSerializer.date_time
 
 
 @api_view(['GET'])
+@cache_response()
 def company_details(request):
     return Response({
         'company_name': settings.COMPANY_NAME,
@@ -118,6 +93,136 @@ class RunPagination(PageNumberPagination):  # Настраиваем пагин
     max_page_size = 50  # Ограничиваем максимальное количество объектов на странице
 
 
+class KeysetPagination(BasePagination):
+    # пагинация по ключу (keyset): страница выбирается условием по паре (поле, id), а не OFFSET,
+    # и без COUNT(*), поэтому любая страница отдаётся одинаково быстро
+    # включается параметрами size или cursor, иначе список отдаётся целиком, как раньше
+    # NULL в поле сортировки всегда идут после значений по возрастанию (перед ними по убыванию) -
+    # так по умолчанию сортирует PostgreSQL и так лежат его индексы; SQLite сортирует иначе, поэтому явно
+    ordering = ('created_at', 'id')  # поле сортировки и уникальный id для одинаковых значений
+    page_size_query_param = 'size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = self.start(request, queryset.model)
+        if cursor is None:
+            return None
+
+        field, _ = self.ordering
+        order_by = queryset.query.order_by
+        self.descending = bool(order_by) and order_by[0] == f'-{field}'  # направление задаёт OrderingFilter
+        backwards = bool(cursor) and cursor['backwards']
+        # назад листаем в обратном порядке и переворачиваем страницу
+        reverse = self.descending != backwards
+        nullable = queryset.model._meta.get_field(field).null
+        queryset = queryset.order_by(*self.order(reverse, nullable))
+        if cursor:
+            queryset = queryset.filter(self.after(cursor['position'], reverse, nullable))
+        return self.page(list(queryset[:self.page_size + 1]), cursor, backwards)
+
+    def paginate_list(self, items, request, model):
+        # то же для объектов в памяти (точки забега из архива, app_run.archive), по возрастанию
+        cursor = self.start(request, model)
+        if cursor is None:
+            return None
+        self.descending = False
+        backwards = bool(cursor) and cursor['backwards']
+        items = sorted(items, key=lambda item: self.sort_key(self.position(item)), reverse=backwards)
+        if cursor:
+            border = self.sort_key(cursor['position'])
+            items = [item for item in items
+                     if (self.sort_key(self.position(item)) < border if backwards else
+                         self.sort_key(self.position(item)) > border)]
+        return self.page(items[:self.page_size + 1], cursor, backwards)
+
+    def sort_key(self, position):
+        # NULL после любых значений, как в order()
+        return [(value is None, value if value is not None else 0) for value in position]
+
+    def start(self, request, model):
+        # разбирает size и cursor; None - пагинация не запрошена, {} - первая страница
+        size = request.query_params.get(self.page_size_query_param)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if size is None and encoded is None:
+            return None
+        self.request = request
+        self.page_size = self.max_page_size
+        if size is not None and size.isdigit() and int(size) > 0:
+            self.page_size = min(int(size), self.max_page_size)
+        return self.decode_cursor(model, encoded) or {}
+
+    def page(self, page, cursor, backwards):
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if backwards:
+            page.reverse()
+        self.next_position = self.position(page[-1]) if page and (has_more or backwards) else None
+        self.previous_position = self.position(page[0]) if page and cursor and (has_more or not backwards) else None
+        return page
+
+    def order(self, reverse, nullable):
+        field, key = self.ordering
+        if nullable:
+            field_order = F(field).desc(nulls_first=True) if reverse else F(field).asc(nulls_last=True)
+        else:
+            field_order = f'-{field}' if reverse else field
+        return [field_order, f'-{key}' if reverse else key]
+
+    def after(self, position, reverse, nullable=False):
+        # строки строго после позиции курсора в текущем направлении;
+        # отдельное условие field >= value даёт базе диапазон по индексу, одного OR ей мало
+        (field, value), (key, key_value) = zip(self.ordering, position)
+        lookup = 'lt' if reverse else 'gt'
+        key_after = Q(**{f'{key}__{lookup}': key_value})
+        if value is None:
+            # курсор среди NULL: дальше NULL с большим (меньшим) id, по убыванию - затем все значения
+            nulls_after = Q(**{f'{field}__isnull': True}) & key_after
+            return nulls_after | Q(**{f'{field}__isnull': False}) if reverse else nulls_after
+        strictly_after = Q(**{f'{field}__{lookup}e': value}) & (Q(**{f'{field}__{lookup}': value}) | key_after)
+        if nullable and not reverse:
+            return strictly_after | Q(**{f'{field}__isnull': True})  # NULL идут после всех значений
+        return strictly_after
+
+    def position(self, instance):
+        return [getattr(instance, name) for name in self.ordering]
+
+    def decode_cursor(self, model, encoded):
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = [model._meta.get_field(name).to_python(value)
+                        for name, value in zip(self.ordering, data['p'])]
+            return {'position': position, 'backwards': bool(data.get('b'))}
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound('Неверный cursor')
+
+    def encode_link(self, position, backwards):
+        if position is None:
+            return None
+        # isoformat, а не DjangoJSONEncoder: тот обрезает микросекунды, и курсор съехал бы
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        data = json.dumps({'p': values, 'b': int(backwards)})
+        encoded = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.encode_link(self.next_position, False),
+            'previous': self.encode_link(self.previous_position, True),
+            'results': data,
+        })
+
+
+class RunKeysetPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class PositionKeysetPagination(KeysetPagination):
+    ordering = ('date_time', 'id')
+
+
 class RunViewSet(viewsets.ModelViewSet):
     # с select_related мы можем сделать один запрос для получения всех Run и User данных
     # так избавимся от проблемы n + 1
@@ -127,13 +232,79 @@ class RunViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, OrderingFilter]  # Указываем какой класс будет исп. для фильтра и сортировки
     filterset_fields = ['status', 'athlete']  # Поля, по которым будет происходить фильтрация
     ordering_fields = ['created_at']  # Поля, по которым будет возможна сортировка
-    pagination_class = RunPagination  # Указываем пагинацию
+    pagination_class = RunKeysetPagination  # Указываем пагинацию
+
+    @cache_response(Run, User)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(Run, User)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        # у забега, учтённого в итогах атлета, могли смениться статус, дистанция, время или атлет -
+        # итоги пересчитываются в той же транзакции
+        athlete_id, counted = serializer.instance.athlete_id, is_counted(serializer.instance)
+        with transaction.atomic():
+            run = serializer.save()
+            if counted or is_counted(run):
+                refresh_athlete_stats(athlete_id)
+                if run.athlete_id != athlete_id:
+                    refresh_athlete_stats(run.athlete_id)
+
+    @action(detail=True, methods=['get'])
+    def track(self, request, pk=None):
+        # весь трек забега; ?encoding=binary отдаёт сжатый RunTrack как есть (формат в app_run.tracks)
+        # ?zoom=<0..22> упрощает линию под масштаб карты, для законченных забегов результат кэшируется
+        # под версией треков забега (сигналы Run и Position меняют её при правке и удалении)
+        from app_run.tracks import run_track_points, simplify_track, MAX_ZOOM
+
+        run = get_object_or_404(Run.objects.only('id', 'status'), pk=pk)
+        if request.query_params.get('encoding') == 'binary':
+            track = get_object_or_404(RunTrack.objects.only('data'), run_id=run.id)
+            return HttpResponse(bytes(track.data), content_type='application/octet-stream')
+
+        zoom = request.query_params.get('zoom')
+        if zoom is not None:
+            if not zoom.isdigit() or int(zoom) > MAX_ZOOM:
+                return Response({'zoom': f'zoom от 0 до {MAX_ZOOM}'}, status=status.HTTP_400_BAD_REQUEST)
+            version, = model_versions([RUN_TRACK.format(run.id)])
+            cache_key = f'run-track:{run.id}:{zoom}:{version}'
+            points = cache.get(cache_key)
+            if points is not None:
+                return Response(points)
+
+        points = run_track_points(run.id)
+        if zoom is not None:
+            points = simplify_track(points, int(zoom))
+        for point in points:
+            if point['date_time']:
+                point['date_time'] = point['date_time'].strftime(TRACK_DATE_FORMAT)
+        if zoom is not None and run.status == Run.FINISHED:
+            cache.set(cache_key, points, settings.TRACK_CACHE_TIMEOUT)  # трек законченного забега не меняется
+        return Response(points)
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        # отрезки по километру, время в движении и зоны темпа из RunSplits (app_run.splits), точки не читаются;
+        # забегам, законченным до появления RunSplits, аналитика считается по RunTrack при первом запросе
+        from app_run.splits import save_run_splits, splits_data
+
+        run = get_object_or_404(Run.objects.only('id', 'status', 'finalize_status'), pk=pk)
+        splits = RunSplits.objects.filter(run_id=run.id).first()
+        if splits is None:
+            if run.status != Run.FINISHED or run.finalize_status != RunFinalizeJob.DONE:
+                return Response({'detail': 'Аналитика появится после постобработки законченного забега'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            splits = save_run_splits(run.id)
+        return Response(splits_data(run, splits))
 
 
 class GetUsers(viewsets.ReadOnlyModelViewSet):
     # получаем всех пользователей, есть фильтр тренеры/атлеты
-    queryset = User.objects.filter(is_superuser=False).annotate(
-        runs_finished=Count('runs', filter=Q(runs__status='finished')))
+    # runs_finished берётся из AthleteStats одним JOIN, без подсчёта забегов на каждый запрос
+    queryset = User.objects.filter(is_superuser=False).select_related('athlete_stats')
 
     serializer_class = UserSerializer
 
@@ -153,7 +324,7 @@ class GetUsers(viewsets.ReadOnlyModelViewSet):
 
     # Для динамической фильтрации данных будем переопределять метод get_queryset
     def get_queryset(self):
-        qs = self.queryset
+        qs = self.queryset.all()  # .all() - иначе результат класс-атрибута закэшируется между запросами
         type = self.request.query_params.get('type')
         if type == 'coach':
             qs = qs.filter(is_staff=True)
@@ -161,6 +332,15 @@ class GetUsers(viewsets.ReadOnlyModelViewSet):
             qs = qs.filter(is_staff=False)
         return qs
 
+    # runs_finished живёт в AthleteStats, items - в M2M CollectibleItem.users
+    @cache_response(User, AthleteStats, CollectibleItem)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(User, AthleteStats, CollectibleItem)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class StartView(APIView):
     # создание статуса забега
@@ -177,15 +357,23 @@ class StartView(APIView):
 
         if condition in condition_dict:
             item.status = condition_dict[condition]
+        if condition == 'stop':
+            item.finalize_status = RunFinalizeJob.PENDING  # клиент опрашивает это поле до 'done'
         serializer = RunSerializer(item, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
             if condition == 'stop':
-                check_runs(run_id)
-                count_distance(run_id)
-                check_50_km(run_id)
-                total_running_time_in_seconds(run_id)
-                all_positions_speed(run_id)
+                flush_local()  # точки, которые этот процесс ещё держит в буфере (app_run.buffer)
+            with transaction.atomic():
+                serializer.save()
+                if condition == 'stop' and settings.RUN_FINALIZE_ASYNC:
+                    enqueue_finalize(item)
+            if condition == 'stop' and not settings.RUN_FINALIZE_ASYNC:
+                try:
+                    finalize_run(item.id)
+                except PendingPoints:
+                    enqueue_finalize(item)  # часть точек в буфере других процессов - доделает воркер
+                item.refresh_from_db()
+                serializer = RunSerializer(item)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -222,12 +410,15 @@ class AllChallenges(viewsets.ModelViewSet):
     serializer_class = ChallengeSerializer
 
     def get_queryset(self):
-        if self.queryset:
-            qs = self.queryset
-            athlete = self.request.query_params.get('athlete')
-            if athlete:
-                qs = qs.filter(athlete=athlete)
-            return qs
+        qs = self.queryset.all()
+        athlete = self.request.query_params.get('athlete')
+        if athlete:
+            qs = qs.filter(athlete=athlete)
+        return qs
+
+    @cache_response(Challenge)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
 
 class PositionViewSet(viewsets.ModelViewSet):
@@ -236,53 +427,152 @@ class PositionViewSet(viewsets.ModelViewSet):
     serializer_class = PositionSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['run']
+    pagination_class = PositionKeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        # точки давно законченного забега с ?run= читаются из его трека (app_run.archive); без ?run= список
+        # идёт только по таблице Position, и точек архивных забегов в нём нет - их отдаёт ?run=<id>;
+        # при отложенной записи (app_run.buffer) ещё не записанные точки забега (id у них null) добавляются
+        # в конец списка без пагинации; в постраничный ответ они не попадают - у них нет позиции для курсора,
+        # страница появится после сброса буфера
+        response = super().list(request, *args, **kwargs)
+        run_id = request.query_params.get('run', '')
+        if not run_id.isdigit():
+            return response
+        page = response.data if isinstance(response.data, list) else response.data['results']
+        if not page and RunTrack.objects.filter(run_id=run_id, archived_at__isnull=False).exists():
+            return self.archived_list(request, int(run_id))
+        if not settings.POSITION_WRITE_BEHIND or not isinstance(response.data, list):
+            return response
+        # точка, записанная между коммитом и удалением сегмента журнала, уже есть в ответе
+        stored = {(p['date_time'], p['latitude'], p['longitude']) for p in page}
+        page += [p for p in PositionSerializer(buffered_positions(int(run_id)), many=True).data
+                 if (p['date_time'], p['latitude'], p['longitude']) not in stored]
+        return response
+
+    def archived_list(self, request, run_id):
+        from app_run.archive import archived_positions  # numpy нужен только здесь
+
+        positions = archived_positions(run_id)
+        page = self.paginator.paginate_list(positions, request, Position)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(positions, many=True).data)
 
     def create(self, request, *args, **kwargs):
+        # список точек в теле запроса - пакетная загрузка, иначе одна точка
+        if isinstance(request.data, list):
+            return self.create_batch(request.data)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(request, serializer)
-        search_collectible(serializer.data)
+        instance = self.perform_create(serializer)
+        if settings.POSITION_WRITE_BEHIND:
+            # точка принята в буфер: id появится после записи в базу, лента и предметы - тогда же
+            return Response(PositionSerializer(instance).data, status=status.HTTP_202_ACCEPTED)
+        publish_positions(instance.run.athlete_id, [instance])
+        search_collectible(instance.run, [(instance.latitude, instance.longitude)])
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def perform_create(self, request, serializer):
-        run = request.data['run']
-        prev_positions = Position.objects.filter(run=run).last()
-        current_position = request.data['date_time']
-
-        point1 = Point(prev_positions.latitude, prev_positions.longitude)
-        point2 = Point(request.data['latitude'], request.data['longitude'])
-
-        date = str(prev_positions.date_time)[:25]
-        time1 = parser.parse(date)
-        time2 = parser.parse(current_position.replace('T', ' '))
-        delta_time = (time2 - time1).total_seconds()
-
-        distance_m = geodesic(point1, point2).meters
-        speed_ms = round(distance_m / delta_time, 2)
-
-        distance_km = geodesic(point1, point2).kilometers
-        all_distance = prev_positions.distance
-        if all_distance:
-            all_distance += distance_km
-        else:
-            all_distance = distance_km
-
-        instance = serializer.save()
-        instance.speed = speed_ms
-        instance.distance = round(all_distance, 2)
-        instance.save()
+    def perform_create(self, serializer):
+        from app_run.distance import track_steps
+
+        # забег и предыдущая точка - из состояния приёма точек (app_run.ingest), без запросов в базу
+        data = serializer.validated_data
+        prev_position = last_position(data['run'].id, get_session(data['run'].id))
+        position = Position(**data)
+        distance_km = track_steps(prev_position, [position])
+        if settings.POSITION_WRITE_BEHIND:
+            accept_positions(data['run'], [position], distance_km)
+            remember_positions(position.run_id, [position])
+            return position
+        instance = serializer.save(speed=position.speed, distance=position.distance)
+        add_to_run_totals(instance.run_id, [instance], distance_km)
+        remember_positions(instance.run_id, [instance])
+        return instance
+
+    def create_batch(self, items):
+        # принимает упорядоченный список точек одного забега:
+        # забег проверяется один раз, скорость и дистанция считаются за один проход,
+        # запись в базу одним bulk_create, в ответе результат по каждой точке
+        from app_run.distance import track_steps
+
+        if not items:
+            return Response({'detail': 'Пустой список точек'}, status=status.HTTP_400_BAD_REQUEST)
+        run_ids = {str(item.get('run')) if isinstance(item, dict) else '' for item in items}
+        if len(run_ids) != 1:
+            return Response({'run': 'Все точки должны относиться к одному забегу'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        run_id = run_ids.pop()
+        state = get_session(int(run_id)) if run_id.isdigit() else None
+        if state is None:
+            return Response({'run': 'Забег не найден'}, status=status.HTTP_400_BAD_REQUEST)
+        run = session_run(int(run_id), state)
+        if run.status != 'in_progress':
+            return Response({'run': "Статус забега должен быть 'in progress'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        new_positions = []
+        for index, item in enumerate(items):
+            serializer = PositionBatchItemSerializer(data=item)
+            if not serializer.is_valid():
+                results.append({'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+                continue
+            new_positions.append(Position(run=run, **serializer.validated_data))
+            results.append({'index': index, 'status': status.HTTP_201_CREATED})
+
+        if not new_positions:
+            return Response(results, status=status.HTTP_400_BAD_REQUEST)
+
+        prev_position = last_position(run.id, state)
+        batch_distance = track_steps(prev_position, new_positions)
+        if settings.POSITION_WRITE_BEHIND:
+            accept_positions(run, new_positions, batch_distance)
+            remember_positions(run.id, new_positions)
+            return self.batch_response(results, new_positions, len(items), status.HTTP_202_ACCEPTED)
+        with transaction.atomic():
+            Position.objects.bulk_create(new_positions)
+            bump_version(Position)
+            add_to_run_totals(run.id, new_positions, batch_distance)
+            remember_positions(run.id, new_positions)
+            publish_positions(run.athlete_id, new_positions)
+            search_collectible(run, [(p.latitude, p.longitude) for p in new_positions])
+        return self.batch_response(results, new_positions, len(items), status.HTTP_201_CREATED)
+
+    def batch_response(self, results, new_positions, total, success_status):
+        created = iter(PositionSerializer(new_positions, many=True).data)
+        for result in results:
+            if result['status'] == status.HTTP_201_CREATED:
+                result['status'] = success_status
+                result['data'] = next(created)
+        response_status = success_status if len(new_positions) == total else status.HTTP_207_MULTI_STATUS
+        return Response(results, status=response_status)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def perform_destroy(self, instance):
+        # у Position нет приёмника post_delete (app_run.signals), версию и состояние приёма сбрасываем здесь
+        run_id = instance.run_id
+        instance.delete()
+        bump_version(Position, RUN_TRACK.format(run_id))
+        transaction.on_commit(lambda: forget_session(run_id))
+
 
 class CollectibleView(viewsets.ModelViewSet):
     # вернёт список CollectibleItem из БД
     queryset = CollectibleItem.objects.all()
     serializer_class = CollectibleSerializer
 
+    @cache_response(CollectibleItem)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cache_response(CollectibleItem)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class UploadFileView(viewsets.ModelViewSet):
     # view принимает xlsx-файл, читает, валидирует его и записывает эти данные в базу
@@ -292,26 +582,107 @@ class UploadFileView(viewsets.ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         file = request.FILES.get('file')  # получаем файл из запроса
-        # поле в присланном request-e мы назвали file (выше)
-        workbook = openpyxl.load_workbook(file)  # открывает Excel файл
-        sheet = workbook.active
-        broken_lines = []
-
-        for row in sheet.iter_rows(values_only=True, min_row=2):
-            row_data = {
-                'name': row[0],
-                'uid': row[1],
-                'value': row[2],
-                'latitude': row[3],
-                'longitude': row[4],
-                'picture': row[5]
-            }
-
-            serializer = self.get_serializer(data=row_data)
-
-            if serializer.is_valid():
-                serializer.save()
-            else:
-                broken_lines.append(list(row))
+        # поле в присланном request-e мы назвали file (выше), принимаем xlsx и csv
+        # строки пишутся пачками до ответа, в ответ потоком уходят битые строки
+        from app_run.importers import import_collectibles, stream_json_list
+
+        if file is None:
+            return Response({'file': 'Файл не передан'}, status=status.HTTP_400_BAD_REQUEST)
+        broken_lines = import_collectibles(file)
+        return StreamingHttpResponse(stream_json_list(broken_lines), content_type='application/json')
+
+
+class GpxImportView(APIView):
+    # импорт истории забегов: multipart с полем athlete и одним или несколькими file (gpx или zip с gpx)
+    # в запросе файлы разбираются в одном процессе, пул процессов - в python manage.py import_gpx
+    def post(self, request):
+        from app_run.gpx import import_gpx, iter_sources
+
+        files = request.FILES.getlist('file')
+        if not files:
+            return Response({'file': 'Файл не передан'}, status=status.HTTP_400_BAD_REQUEST)
+        athlete = str(request.data.get('athlete', ''))
+        if not athlete.isdigit() or not User.objects.filter(pk=athlete, is_staff=False).exists():
+            return Response({'athlete': 'Атлет не найден'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = import_gpx(int(athlete), iter_sources(files))
+        except ValueError as error:  # архив больше пределов GPX_MAX_FILES/GPX_MAX_FILE_BYTES
+            return Response({'file': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        response_status = status.HTTP_201_CREATED if report['runs'] else status.HTTP_400_BAD_REQUEST
+        return Response(report, status=response_status)
+
 
-        return Response(broken_lines)
+@api_view(['GET'])
+def export_data(request, kind, fmt):
+    # выгрузка для аналитики: /api/export/runs|tracks/csv|ndjson|gpx/?athlete=&status=&date_from=&date_to=
+    # ответ отдаётся потоком, память не растёт с размером выгрузки (app_run.exports)
+    if kind not in ('runs', 'tracks'):
+        raise NotFound()
+    try:
+        runs = filter_runs(request.query_params)
+    except ValidationError as error:
+        return Response(error.message_dict, status=status.HTTP_400_BAD_REQUEST)
+    stream = export_stream(kind, fmt, runs)
+    if stream is None:
+        return Response({'format': f'Формат {fmt} для {kind} не поддерживается'}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(stream, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+def live_response(request, feed):
+    # лента Server-Sent Events (app_run.live): под ASGI асинхронный генератор, под WSGI синхронный
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    if last_id and not last_id.isdigit():
+        return JsonResponse({'last_id': 'id точки - целое число'}, status=400)
+    last_id = int(last_id) if last_id else None
+    stream = async_event_stream(feed, last_id) if isinstance(request, ASGIRequest) else event_stream(feed, last_id)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не должен копить ленту в буфере
+    return response
+
+
+@require_GET
+def live_run(request, run_id):
+    # новые точки одного забега вместо опроса /api/positions/?run=<id>
+    if not run_id.isdigit() or not Run.objects.filter(pk=run_id).exists():
+        raise Http404
+    return live_response(request, Feed(run_id=int(run_id)))
+
+
+@require_GET
+def live_athletes(request):
+    # новые точки забегов в процессе у группы атлетов: ?athletes=1,2,3 (дашборд тренера)
+    athlete_ids = request.GET.get('athletes', '').split(',')
+    if not all(athlete_id.isdigit() for athlete_id in athlete_ids):
+        return JsonResponse({'athletes': 'Список id атлетов через запятую'}, status=400)
+    return live_response(request, Feed(athlete_ids=map(int, athlete_ids)))
+
+
+def heatmap_etag(request, zoom, x, y):
+    # версия карты меняется с каждым добавленным забегом (app_run.heatmap), базу не трогаем
+    version, = model_versions([HeatmapCell])
+    return f'"heatmap-{version}-{zoom}-{x}-{y}"'
+
+
+@require_GET
+@condition(etag_func=heatmap_etag)
+def heatmap_tile(request, zoom, x, y):
+    # готовые ячейки тайла тепловой карты: cells - [x в тайле, y в тайле, runs, points],
+    # тайл размером cells_per_side x cells_per_side; повторный запрос с If-None-Match получает 304
+    if zoom > settings.HEATMAP_MAX_ZOOM or x >= 2 ** zoom or y >= 2 ** zoom:
+        raise Http404
+    size = settings.HEATMAP_CELLS
+    rows = HeatmapCell.objects.filter(
+        zoom=zoom, x__gte=x * size, x__lt=(x + 1) * size, y__gte=y * size, y__lt=(y + 1) * size
+    ).values_list('x', 'y', 'runs', 'points')
+    response = JsonResponse({
+        'zoom': zoom,
+        'x': x,
+        'y': y,
+        'cells_per_side': size,
+        'cells': [[cell_x - x * size, cell_y - y * size, runs, points] for cell_x, cell_y, runs, points in rows],
+    })
+    patch_cache_control(response, public=True, max_age=settings.HEATMAP_MAX_AGE)
+    return response
@@ -8,9 +8,16 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+import time
 
-from django.core.asgi import get_asgi_application
+started = time.perf_counter()  # начало холодного старта, см. app_run.metrics.COLD_START
+
+from django.core.asgi import get_asgi_application  # noqa: E402
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_run.settings')
 
 application = get_asgi_application()
+
+from app_run.metrics import mark_process_started  # noqa: E402
+
+mark_process_started(started)
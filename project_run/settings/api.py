@@ -0,0 +1,33 @@
+from .production import *
+
+# Профиль только для API на Lambda (DJANGO_SETTINGS_MODULE=project_run.settings.api):
+# всё как в production, но без админки, сессий, сообщений и статики - приложения и middleware,
+# которые API не использует, не импортируются и не выполняются на холодном старте.
+# Админка и collectstatic остаются в project_run.settings.production.
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+
+    'rest_framework',
+    'django_filters',
+
+    'app_run',
+]
+
+MIDDLEWARE = [
+    'app_run.metrics.RequestMetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+# только JSON: browsable API тянет шаблоны и статику, а сессионная авторизация - сессии
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': ['app_run.metrics.TimedJSONRenderer'],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+}
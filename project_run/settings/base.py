@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +31,53 @@ COMPANY_NAME = 'Ночной забег',
 SLOGAN = 'Ноль - тоже результат',
 CONTACTS = 'Город Москва, улица Пушкина, дом 3'
 
+# Формула расчёта расстояний в app_run.distance: 'lambert' (эллипсоид WGS-84) или 'haversine' (сфера)
+DISTANCE_FORMULA = 'lambert'
+# Постобработка забега после stop: True - очередь RunFinalizeJob и воркер run_finalize_worker,
+# False - сразу в запросе (удобно, когда воркер не запущен)
+RUN_FINALIZE_ASYNC = True
+# Сохранять при постобработке сжатый трек забега (RunTrack), его отдаёт /api/runs/<id>/track/
+STORE_RUN_TRACKS = True
+# True - трек без потерь заменяет строки Position забега сразу при постобработке (app_run.archive);
+# по умолчанию строки остаются до python manage.py archive_positions --days N. Только вместе с STORE_RUN_TRACKS
+ARCHIVE_ON_FINALIZE = False
+# Сколько секунд хранить в кэше упрощённый под zoom трек законченного забега
+TRACK_CACHE_TIMEOUT = 60 * 60 * 24
+# Аналитика забега (app_run.splits): с какой скорости (м/с) участок считается движением
+# и границы зон темпа в секундах на км (4:00, 4:30, 5:00, 5:30, 6:00, 7:00)
+RUN_MOVING_SPEED = 0.5
+RUN_PACE_ZONES = [240, 270, 300, 330, 360, 420]
+# Тепловая карта (app_run.heatmap): zoom от 0 до HEATMAP_MAX_ZOOM, ячеек по стороне тайла
+# и сколько секунд браузер и CDN держат тайл без перепроверки
+HEATMAP_MAX_ZOOM = 14
+HEATMAP_CELLS = 32
+HEATMAP_MAX_AGE = 300
+# Импорт GPX (app_run.gpx): сколько gpx-файлов допускается в одном zip и сколько байт в одном файле после распаковки
+GPX_MAX_FILES = 1000
+GPX_MAX_FILE_BYTES = 50 * 1024 * 1024
+# Потоков для расчёта расстояний в асинхронных view (app_run.async_views)
+ASYNC_DISTANCE_THREADS = 4
+# Сколько секунд хранить в кэше состояние приёма точек забега (app_run.ingest)
+INGEST_SESSION_TIMEOUT = 60 * 60
+# Живая лента точек (app_run.live): пинг после стольких секунд тишины, пауза переподключения EventSource,
+# сколько точек дочитывать из базы за раз и сколько последних отправленных id помнить
+# (точка, закоммиченная позже точки с большим id, доходит, если попала в это окно)
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_RETRY_MS = 3000
+LIVE_BACKLOG_LIMIT = 1000
+LIVE_SENT_WINDOW = 200
+# Отложенная запись точек (app_run.buffer): точки сначала пишутся в журнал процесса на диске,
+# в базу - пачкой раз в POSITION_FLUSH_INTERVAL_MS мс или по набору POSITION_FLUSH_ROWS точек.
+# POSITION_BUFFER_FSYNC - fsync журнала на каждый запрос: точки переживут и сбой ОС, но запись медленнее
+POSITION_WRITE_BEHIND = False
+POSITION_BUFFER_DIR = BASE_DIR / 'position_buffer'
+POSITION_BUFFER_FSYNC = False
+POSITION_FLUSH_INTERVAL_MS = 200
+POSITION_FLUSH_ROWS = 500
+# Запросы дольше порога (мс) пишутся в лог app_run.metrics с самыми долгими SQL; None - не писать
+SLOW_REQUEST_THRESHOLD_MS = None
+SLOW_REQUEST_TOP_SQL = 5
+
 
 # Application definition
 
@@ -48,6 +96,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_run.metrics.RequestMetricsMiddleware',  # первым, чтобы замерять весь запрос
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +105,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# рендерер JSON с замером времени для метрик (app_run.metrics), browsable API - как по умолчанию
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'app_run.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 ROOT_URLCONF = 'project_run.urls'
 
 TEMPLATES = [
@@ -77,6 +134,21 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'project_run.wsgi.application'
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Файловый кэш общий для всех процессов одной машины - для локального запуска.
+# В production кэш должен быть общим для всех серверов/контейнеров (там DatabaseCache):
+# в нём версии моделей (app_run.caching) и состояние приёма точек (app_run.ingest)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'project_run_cache',
+    }
+}
+# Сколько секунд живёт закэшированный ответ (app_run.caching.cache_response), даже если версия не сменилась
+RESPONSE_CACHE_TIMEOUT = 60 * 10
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -7,5 +7,7 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # несколько процессов run_finalize_worker пишут в одну базу: сразу берём блокировку на запись
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
\ No newline at end of file
@@ -15,6 +15,15 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех контейнеров Lambda: версии моделей и состояние приёма точек должны быть одни на всех.
+# DatabaseCache не требует брокера, таблицу создаёт миграция app_run 0027_cache_table
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'project_run_cache',
+    }
+}
+
 AWS_STORAGE_BUCKET_NAME = 'zappa-ymqd03cou'
 AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 AWS_S3_OBJECT_PARAMETERS = {
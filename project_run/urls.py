@@ -1,10 +1,13 @@
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from app_run.async_views import position_create, run_transition
+from app_run.metrics import metrics
 from app_run.models import Run
 from app_run.views import company_details, GetUsers, RunViewSet, StartView, AthleteInfoView, AllChallenges, \
-    PositionViewSet, CollectibleView, UploadFileView
+    PositionViewSet, CollectibleView, UploadFileView, export_data, \
+    GpxImportView, live_run, live_athletes, heatmap_tile
 from django.conf.urls.static import static
 from django.conf import settings
 
@@ -17,9 +20,21 @@ router.register('api/collectible_item', CollectibleView)
 router.register('api/upload_file', UploadFileView, basename='upload-file')
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/company_details/', company_details),
     path('', include(router.urls)),
     path('api/runs/<run_id>/<condition>/', StartView.as_view()),
     path('api/athlete_info/<user_id>/', AthleteInfoView.as_view()),
+    path('api/export/<kind>/<fmt>/', export_data),
+    path('api/import_gpx/', GpxImportView.as_view()),
+    path('api/async/positions/', position_create),
+    path('api/live/runs/<run_id>/', live_run),
+    path('api/live/athletes/', live_athletes),
+    path('api/async/runs/<run_id>/<condition>/', run_transition),
+    path('api/heatmap/<int:zoom>/<int:x>/<int:y>/', heatmap_tile),
+    path('metrics', metrics),
 ]
+
+if apps.is_installed('django.contrib.admin'):  # в профиле settings.api админки нет
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))